@@ -6,14 +6,13 @@ from sqlalchemy.engine import Connection
 from sqlalchemy.ext.asyncio import async_engine_from_config
 from alembic import context
 
-from app.config import settings
+from app.database import DATABASE_URI
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
 
-# Set database URI
-DATABASE_URI = f'mysql+asyncmy://{settings.DATABASE_USER}:{settings.DATABASE_PASS}@{settings.DATABASE_HOST}:{settings.DATABASE_PORT}/{settings.DATABASE_NAME}'
+# Set database URI, shared with the app
 config.set_main_option('sqlalchemy.url', DATABASE_URI)
 
 # Interpret the config file for Python logging.
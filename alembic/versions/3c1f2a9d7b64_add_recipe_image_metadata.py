@@ -0,0 +1,115 @@
+"""Add recipe image metadata
+
+Revision ID: 3c1f2a9d7b64
+Revises: f969e2715502
+Create Date: 2026-10-18 12:05:41.218034
+
+"""
+import hashlib
+import os
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c1f2a9d7b64'
+down_revision: Union[str, None] = 'f969e2715502'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+IMAGE_DIRECTORY = os.path.join('app', 'static', 'images')
+IMAGE_VARIANTS = ('thumbnail', 'medium', 'large')
+
+recipes = sa.table(
+    'recipes',
+    sa.column('id', sa.Integer),
+    sa.column('image_name', sa.String),
+    sa.column('image_extension', sa.String),
+    sa.column('image_size', sa.Integer),
+    sa.column('image_hash', sa.String),
+)
+
+
+def _has_recipes_table() -> bool:
+    # On a fresh database the tables are created from the models by app.init_data
+    return 'recipes' in sa.inspect(op.get_bind()).get_table_names()
+
+
+def _file_hash(path: str) -> str:
+    content_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(64 * 1024):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+def _move_variants(image_name: str, sharded: bool) -> None:
+    # Resized WebP copies live under <variant>/ with the same layout as the originals
+    for variant in IMAGE_VARIANTS:
+        flat = os.path.join(IMAGE_DIRECTORY, variant, f'{image_name}.webp')
+        shard = os.path.join(IMAGE_DIRECTORY, variant, image_name[:2], f'{image_name}.webp')
+        source, target = (flat, shard) if sharded else (shard, flat)
+        if os.path.exists(source):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(source, target)
+
+
+def upgrade() -> None:
+    if not _has_recipes_table():
+        return
+
+    op.add_column('recipes', sa.Column('image_extension', sa.String(length=10), nullable=True))
+    op.add_column('recipes', sa.Column('image_size', sa.Integer(), nullable=True))
+    op.add_column('recipes', sa.Column('image_hash', sa.String(length=64), nullable=True))
+
+    if not os.path.isdir(IMAGE_DIRECTORY):
+        return
+
+    # Scan the flat images directory once, then move every image into its shard
+    extensions = {}
+    for file in os.listdir(IMAGE_DIRECTORY):
+        name, dot, extension = file.rpartition('.')
+        if dot and os.path.isfile(os.path.join(IMAGE_DIRECTORY, file)):
+            extensions[name] = extension
+
+    bind = op.get_bind()
+    rows = bind.execute(sa.select(recipes.c.id, recipes.c.image_name).where(recipes.c.image_name.isnot(None))).all()
+    for recipe_id, image_name in rows:
+        extension = extensions.get(image_name)
+        if extension is None:
+            continue
+
+        source = os.path.join(IMAGE_DIRECTORY, f'{image_name}.{extension}')
+        target = os.path.join(IMAGE_DIRECTORY, image_name[:2], f'{image_name}.{extension}')
+        size, content_hash = os.path.getsize(source), _file_hash(source)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(source, target)
+        _move_variants(image_name, sharded=True)
+
+        bind.execute(
+            recipes.update().where(recipes.c.id == recipe_id).values(
+                image_extension=extension, image_size=size, image_hash=content_hash
+            )
+        )
+
+
+def downgrade() -> None:
+    if not _has_recipes_table():
+        return
+
+    # Move images and their variants back to the flat layout
+    bind = op.get_bind()
+    rows = bind.execute(
+        sa.select(recipes.c.image_name, recipes.c.image_extension).where(recipes.c.image_extension.isnot(None))
+    ).all()
+    for image_name, extension in rows:
+        source = os.path.join(IMAGE_DIRECTORY, image_name[:2], f'{image_name}.{extension}')
+        if os.path.exists(source):
+            os.replace(source, os.path.join(IMAGE_DIRECTORY, f'{image_name}.{extension}'))
+        _move_variants(image_name, sharded=False)
+
+    op.drop_column('recipes', 'image_hash')
+    op.drop_column('recipes', 'image_size')
+    op.drop_column('recipes', 'image_extension')
@@ -0,0 +1,83 @@
+"""Content-addressed recipe images
+
+Revision ID: 8b7e4d2c1a05
+Revises: 3c1f2a9d7b64
+Create Date: 2026-10-18 15:22:09.734512
+
+"""
+import os
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b7e4d2c1a05'
+down_revision: Union[str, None] = '3c1f2a9d7b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+IMAGE_DIRECTORY = os.path.join('app', 'static', 'images')
+IMAGE_VARIANTS = ('thumbnail', 'medium', 'large')
+
+recipes = sa.table(
+    'recipes',
+    sa.column('id', sa.Integer),
+    sa.column('image_name', sa.String),
+    sa.column('image_extension', sa.String),
+    sa.column('image_hash', sa.String),
+)
+
+
+def _has_recipes_table() -> bool:
+    # On a fresh database the tables are created from the models by app.init_data
+    return 'recipes' in sa.inspect(op.get_bind()).get_table_names()
+
+
+def _move(source: str, target: str) -> None:
+    if not os.path.exists(source):
+        return
+    # Identical content may already be stored under the hash
+    if os.path.exists(target):
+        os.remove(source)
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(source, target)
+
+
+def _relpath(name: str, extension: str) -> str:
+    return os.path.join(name[:2], f'{name}.{extension}')
+
+
+def upgrade() -> None:
+    if not _has_recipes_table():
+        return
+
+    op.create_index(op.f('ix_recipes_image_hash'), 'recipes', ['image_hash'], unique=False)
+
+    # Rename every image and its variants to its content hash
+    bind = op.get_bind()
+    rows = bind.execute(
+        sa.select(recipes.c.id, recipes.c.image_name, recipes.c.image_extension, recipes.c.image_hash)
+        .where(recipes.c.image_hash.isnot(None), recipes.c.image_name != recipes.c.image_hash)
+    ).all()
+    for recipe_id, image_name, extension, image_hash in rows:
+        _move(
+            os.path.join(IMAGE_DIRECTORY, _relpath(image_name, extension)),
+            os.path.join(IMAGE_DIRECTORY, _relpath(image_hash, extension)),
+        )
+        for variant in IMAGE_VARIANTS:
+            _move(
+                os.path.join(IMAGE_DIRECTORY, variant, _relpath(image_name, 'webp')),
+                os.path.join(IMAGE_DIRECTORY, variant, _relpath(image_hash, 'webp')),
+            )
+        bind.execute(recipes.update().where(recipes.c.id == recipe_id).values(image_name=image_hash))
+
+
+def downgrade() -> None:
+    if not _has_recipes_table():
+        return
+
+    # Files keep their hash names, which are still valid image names
+    op.drop_index(op.f('ix_recipes_image_hash'), table_name='recipes')
@@ -0,0 +1,98 @@
+"""Add composite keys and indexes
+
+Revision ID: d41a6c3e9f27
+Revises: 8b7e4d2c1a05
+Create Date: 2026-10-18 16:48:51.402187
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd41a6c3e9f27'
+down_revision: Union[str, None] = '8b7e4d2c1a05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Association table -> (primary key columns, reverse index)
+ASSOCIATIONS = {
+    'recipe_ingredient': (['recipe_id', 'ingredient_id'], 'ix_recipe_ingredient_ingredient_id'),
+    'user_saved_recipes': (['user_id', 'recipe_id'], 'ix_user_saved_recipes_recipe_id'),
+}
+
+
+def _has_recipes_table() -> bool:
+    # On a fresh database the tables are created from the models by app.init_data
+    return 'recipes' in sa.inspect(op.get_bind()).get_table_names()
+
+
+def _has_index_on(table: str, columns: list) -> bool:
+    # MySQL already created an index for each foreign key
+    indexes = sa.inspect(op.get_bind()).get_indexes(table)
+    return any(index['column_names'][:len(columns)] == columns for index in indexes)
+
+
+def _deduplicate(table: str, columns: list) -> None:
+    # Leave one copy of each duplicated row so the primary key can be added, all in SQL.
+    # Only the duplicated pairs are copied aside, into a real table: MySQL DDL is not
+    # transactional, after a crash a rerun finds them there and finishes the job
+    dups = f'{table}_dups'
+    same = ' AND '.join(f'd.{column} = {table}.{column}' for column in columns)
+    names = ', '.join(columns)
+
+    op.execute(f'DELETE FROM {table} WHERE ' + ' OR '.join(f'{column} IS NULL' for column in columns))
+    if dups not in sa.inspect(op.get_bind()).get_table_names():
+        op.execute(f'CREATE TABLE {dups} AS SELECT {names} FROM {table} GROUP BY {names} HAVING COUNT(*) > 1')
+    op.execute(f'DELETE FROM {table} WHERE EXISTS (SELECT 1 FROM {dups} d WHERE {same})')
+    op.execute(
+        f'INSERT INTO {table} ({names}) SELECT {names} FROM {dups} d '
+        f'WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {same})'
+    )
+    op.execute(f'DROP TABLE {dups}')
+
+
+def upgrade() -> None:
+    if not _has_recipes_table():
+        return
+
+    for table, (columns, index) in ASSOCIATIONS.items():
+        _deduplicate(table, columns)
+        for column in columns:
+            op.alter_column(table, column, existing_type=sa.Integer(), nullable=False)
+        op.create_primary_key(f'pk_{table}', table, columns)
+        if not _has_index_on(table, columns[1:]):
+            op.create_index(index, table, columns[1:], unique=False)
+
+    # Keep the latest preference for each ingredient
+    op.execute(
+        'DELETE FROM user_preferences WHERE id NOT IN ('
+        'SELECT id FROM (SELECT MAX(id) AS id FROM user_preferences GROUP BY user_id, ingredient_id) AS latest)'
+    )
+    op.create_unique_constraint('uq_user_preferences_user_ingredient', 'user_preferences', ['user_id', 'ingredient_id'])
+    if not _has_index_on('user_preferences', ['ingredient_id']):
+        op.create_index(op.f('ix_user_preferences_ingredient_id'), 'user_preferences', ['ingredient_id'], unique=False)
+
+    op.create_index(op.f('ix_recipes_created_at'), 'recipes', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    if not _has_recipes_table():
+        return
+
+    op.drop_index(op.f('ix_recipes_created_at'), table_name='recipes')
+
+    indexes = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('user_preferences')}
+    if 'ix_user_preferences_ingredient_id' in indexes:
+        op.drop_index(op.f('ix_user_preferences_ingredient_id'), table_name='user_preferences')
+    op.drop_constraint('uq_user_preferences_user_ingredient', 'user_preferences', type_='unique')
+
+    for table, (columns, index) in ASSOCIATIONS.items():
+        indexes = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+        if index in indexes:
+            op.drop_index(index, table_name=table)
+        op.drop_constraint(f'pk_{table}', table, type_='primary')
+        for column in columns:
+            op.alter_column(table, column, existing_type=sa.Integer(), nullable=True)
@@ -0,0 +1,67 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+
+from app.config import settings
+from app.models import User
+
+class UserCache:
+    """Bounded LRU cache of user column snapshots with a TTL, keyed by token `sub`."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[str, Tuple[float, Dict[str, Any]]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, snapshot: Dict[str, Any]) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, snapshot)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+    async def load(self, db: AsyncSession, key: str) -> Optional[User]:
+        snapshot = self.get(key)
+        if snapshot is None:
+            return None
+
+        # Rebuild a clean detached instance and attach it without a SELECT
+        user = User(**snapshot)
+        make_transient_to_detached(user)
+        return await db.merge(user, load=False)
+
+    def store(self, key: str, user: User) -> None:
+        self.set(key, {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs})
+
+user_cache = UserCache(maxsize=settings.USER_CACHE_MAXSIZE, ttl=settings.USER_CACHE_TTL)
+
+# Invalidate on any flushed update or delete of a user
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_cached_user(mapper, connection, target: User) -> None:
+    user_cache.invalidate(str(target.id))
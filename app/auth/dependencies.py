@@ -1,5 +1,6 @@
 from datetime import datetime
 
+import redis.asyncio as redis
 from fastapi import Depends, HTTPException
 from pydantic import ValidationError
 from jose import jwt
@@ -8,16 +9,21 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import settings
-from app.database import get_db
+from app.database import get_db, get_redis
 from app.models import User
 from app.auth.schemas import TokenPayload
 from app.auth.utils import is_token_revoked
+from app.auth.cache import user_cache
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='login')
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> User:
+async def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_db),
+    r: redis.Redis = Depends(get_redis)
+) -> User:
     # Check if token in blacklist
-    token_revoked = await is_token_revoked(token)
+    token_revoked = await is_token_revoked(token, r)
     if token_revoked:
         raise HTTPException(status_code=401, detail='Token has been revoked')
 
@@ -34,10 +40,18 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession
                 headers={'WWW-Authenticate': 'Bearer'},
             )
 
-        # Get user
-        query = select(User).where(User.id == token_data.sub)
-        result = await db.execute(query)
-        user = result.scalars().first()
+        # Get user, from the in-process cache when possible
+        user = None
+        if settings.USER_CACHE_ENABLED:
+            user = await user_cache.load(db, token_data.sub)
+
+        if not user:
+            query = select(User).where(User.id == token_data.sub)
+            result = await db.execute(query)
+            user = result.scalars().first()
+            if user and settings.USER_CACHE_ENABLED:
+                user_cache.store(token_data.sub, user)
+
         if not user:
             raise HTTPException(
                 status_code=404,
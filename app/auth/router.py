@@ -1,14 +1,18 @@
 from datetime import datetime, timezone
+from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException
+import redis.asyncio as redis
+from fastapi import APIRouter, Body, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
+from jose import jwt
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.config import settings
 from app.schemas import UserCreate, UserRead
-from app.database import get_db
+from app.database import get_db, get_redis
 from app.models import User
-from app.auth.utils import get_hashed_password, verify_password, create_access_token, revoke_token
+from app.auth.utils import hash_password, check_password, create_access_token, revoke_tokens
 from app.auth.schemas import Token, TokenPayload
 from app.auth.dependencies import get_current_user, get_token_payload, oauth2_scheme
 
@@ -23,8 +27,8 @@ async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
     if user_found:
         raise HTTPException(409, 'User already exists')
 
-    # Hashing password
-    user.password = get_hashed_password(user.password)
+    # Hashing password, off the event loop
+    user.password = await hash_password(user.password)
 
     # New user instance
     new_user = User(**user.model_dump())
@@ -46,9 +50,15 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSessi
         raise HTTPException(401, 'Incorrect username or password')
 
     # Check password
-    if not verify_password(form_data.password, user.password):
+    valid, new_hash = await check_password(form_data.password, user.password)
+    if not valid:
         raise HTTPException(401, 'Incorrect username or password')
 
+    # Rehash transparently when the configured cost changed
+    if new_hash:
+        user.password = new_hash
+        await db.commit()
+
     # Create JWT Token
     access_token = create_access_token(user.id)
 
@@ -59,12 +69,31 @@ async def verify_token(current_user: int = Depends(get_current_user)):
     return {'status': 'Token is valid', 'user_id': current_user.id}
 
 @router.post('/logout', status_code=200)
-async def logout(payload: TokenPayload = Depends(get_token_payload), token: str = Depends(oauth2_scheme)):
-    now = datetime.now(timezone.utc)
-    expires_in = payload.exp - int(now.timestamp())
+async def logout(
+    tokens: List[str] = Body([], description='Other tokens of the same user to revoke with this one'),
+    payload: TokenPayload = Depends(get_token_payload),
+    token: str = Depends(oauth2_scheme),
+    r: redis.Redis = Depends(get_redis)
+):
+    now = int(datetime.now(timezone.utc).timestamp())
+    expires_in = payload.exp - now
 
     if expires_in <= 0:
         raise HTTPException(status_code=400, detail='Token is already expired')
 
-    await revoke_token(token, expires_in)
-    return {'detail': 'Token has been revoked'}
\ No newline at end of file
+    revoked = {token: expires_in}
+    for other in tokens:
+        try:
+            other_payload = TokenPayload(**jwt.decode(other, settings.JWT_SECRET_KEY, algorithms=[settings.JWT_ALGORITHM]))
+        except jwt.ExpiredSignatureError:
+            # Already unusable
+            continue
+        except jwt.JWTError:
+            raise HTTPException(status_code=403, detail='Could not validate token')
+        if other_payload.sub != payload.sub:
+            raise HTTPException(status_code=403, detail='Not authorized to revoke this token')
+        if other_payload.exp > now:
+            revoked[other] = other_payload.exp - now
+
+    await revoke_tokens(revoked, r)
+    return {'detail': 'Token has been revoked'}
@@ -1,13 +1,26 @@
-from typing import Union, Any
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, Any, Dict, Tuple
 from datetime import timedelta, datetime
 
+import redis.asyncio as redis
+from fastapi import HTTPException
 from passlib.context import CryptContext
 from jose import jwt
 
 from app.config import settings
-from app.database import get_redis
 
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+def create_password_context(rounds: int) -> CryptContext:
+    # Hashes with any other cost are reported as needing an update
+    return CryptContext(
+        schemes=['bcrypt'],
+        deprecated='auto',
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds
+    )
+
+pwd_context = create_password_context(settings.PASSWORD_HASH_ROUNDS)
 
 # Password hash
 def get_hashed_password(password: str) -> str:
@@ -16,6 +29,39 @@ def get_hashed_password(password: str) -> str:
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
+# bcrypt releases the GIL, so a few threads hash in parallel off the event loop
+password_executor: ThreadPoolExecutor | None = None
+password_tasks = 0
+
+def stop_password_executor() -> None:
+    global password_executor
+    if password_executor is not None:
+        password_executor.shutdown(wait=True, cancel_futures=True)
+        password_executor = None
+
+async def _run_password_task(func, *args):
+    global password_executor, password_tasks
+    # Admission control: running plus queued hashes are bounded, past that fail fast
+    if password_tasks >= settings.PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(503, 'Too many requests, try again later', headers={'Retry-After': '1'})
+    if password_executor is None:
+        password_executor = ThreadPoolExecutor(
+            max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix='password'
+        )
+
+    password_tasks += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+    finally:
+        password_tasks -= 1
+
+async def hash_password(password: str) -> str:
+    return await _run_password_task(get_hashed_password, password)
+
+async def check_password(plain_password: str, hashed_password: str) -> Tuple[bool, str | None]:
+    """Verify a password. Also returns a new hash when the stored one uses an outdated cost."""
+    return await _run_password_task(pwd_context.verify_and_update, plain_password, hashed_password)
+
 # Token generation
 def create_access_token(subject: Union[str, Any]) -> str:
     expires_delta = datetime.utcnow() + timedelta(minutes=settings.JWT_EXPIRE_MINUTES)
@@ -24,16 +70,18 @@ def create_access_token(subject: Union[str, Any]) -> str:
     return encoded_jwt
 
 # Cache Tokens
-async def revoke_token(token: str, expires_in: int):
-    r = await get_redis()
+async def revoke_token(token: str, expires_in: int, r: redis.Redis):
     await r.set(token, 'revoked', ex=expires_in)
-    await r.aclose()
 
-async def is_token_revoked(token: str) -> bool:
-    r = await get_redis()
+async def revoke_tokens(tokens: Dict[str, int], r: redis.Redis):
+    # One round trip for the whole batch
+    async with r.pipeline(transaction=False) as pipe:
+        for token, expires_in in tokens.items():
+            pipe.set(token, 'revoked', ex=expires_in)
+        await pipe.execute()
+
+async def is_token_revoked(token: str, r: redis.Redis) -> bool:
     token_status = await r.get(token)
-    await r.aclose()
     if token_status:
         return token_status.decode('utf-8')  == 'revoked'
     return False
-
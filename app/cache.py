@@ -0,0 +1,175 @@
+# Redis response cache for public read endpoints
+import hashlib
+import json
+import logging
+import time
+from typing import Any, Iterable, List
+
+import redis.asyncio as redis
+from fastapi import Depends, Request, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.database import engine, get_read_db, get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'response:'
+TAG_PREFIX = 'response-tag:'
+# Every entry and tag set, so invalidate_all never scans the keyspace
+KEYS_KEY = 'response-keys'
+# Bumped by every invalidation, a fill that saw another value may hold stale rows
+GENERATION_KEY = 'response-generation'
+# Time of the last invalidation, replicas may not have the write yet
+INVALIDATED_AT_KEY = 'response-invalidated-at'
+
+_UNREAD = object()
+
+# Tags shared by every list page
+RECIPES_TAG = 'recipes'
+INGREDIENTS_TAG = 'ingredients'
+
+def recipe_tag(recipe_id: int) -> str:
+    return f'recipe:{recipe_id}'
+
+def ingredient_tag(ingredient_id: int) -> str:
+    return f'ingredient:{ingredient_id}'
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates
+
+class ResponseCache:
+    """
+    Serialized JSON bodies stored in Redis, keyed by path and query string.
+
+    Each entry is registered under tags so write endpoints can drop every page that shows
+    a changed row. The invalidation generation is read with the entry and an entry is only
+    stored if it did not change meanwhile, so a request that queried the database before a
+    write cannot cache its body after the write invalidated it. Bodies read from a replica
+    are not stored within DATABASE_REPLICA_LAG_SECONDS of an invalidation, the replica may
+    not have the write yet. Redis errors only disable caching, the endpoint still answers.
+    """
+
+    def __init__(self, request: Request, r: redis.Redis, ttl: int, replica: bool = False):
+        self.request = request
+        self.r = r
+        self.ttl = ttl
+        self.replica = replica
+        query = '&'.join(sorted(request.url.query.split('&'))) if request.url.query else ''
+        self.key = f'{KEY_PREFIX}{request.url.path}?{query}'
+        self.generation = _UNREAD
+        self.invalidated_at = None
+
+    def _response(self, body: bytes, etag: str) -> Response:
+        # no-cache: clients keep the body but revalidate it with the ETag
+        headers = {'etag': etag, 'cache-control': 'no-cache'}
+        if etag_matches(self.request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type='application/json', headers=headers)
+
+    async def get(self) -> Response | None:
+        if not settings.RESPONSE_CACHE_ENABLED:
+            return None
+        try:
+            async with self.r.pipeline(transaction=False) as pipe:
+                pipe.hmget(self.key, 'body', 'etag')
+                pipe.mget(GENERATION_KEY, INVALIDATED_AT_KEY)
+                (body, etag), (self.generation, self.invalidated_at) = await pipe.execute()
+        except redis.RedisError:
+            logger.warning('Response cache unavailable', exc_info=True)
+            return None
+        if body is None or etag is None:
+            return None
+        return self._response(body, etag.decode('utf-8'))
+
+    async def set(self, content: Any, tags: Iterable[str]) -> Response:
+        """Store `content`, a model, plain data or an already serialized JSON body, and answer with it."""
+        if isinstance(content, bytes):
+            body = content
+        elif isinstance(content, BaseModel):
+            body = content.model_dump_json().encode('utf-8')
+        else:
+            body = json.dumps(jsonable_encoder(content), separators=(',', ':')).encode('utf-8')
+        etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+        if settings.RESPONSE_CACHE_ENABLED and not self._lagging():
+            try:
+                await self._store(body, etag, [TAG_PREFIX + tag for tag in tags])
+            except redis.WatchError:
+                # Invalidated between the check and the write
+                pass
+            except redis.RedisError:
+                logger.warning('Response cache unavailable', exc_info=True)
+        return self._response(body, etag)
+
+    def _lagging(self) -> bool:
+        if not self.replica or self.invalidated_at is None:
+            return False
+        return time.time() - float(self.invalidated_at) < settings.DATABASE_REPLICA_LAG_SECONDS
+
+    async def _store(self, body: bytes, etag: str, tag_keys: List[str]) -> None:
+        async with self.r.pipeline(transaction=True) as pipe:
+            await pipe.watch(GENERATION_KEY)
+            if await pipe.get(GENERATION_KEY) != self.generation:
+                return
+            pipe.multi()
+            pipe.hset(self.key, mapping={'body': body, 'etag': etag})
+            pipe.expire(self.key, self.ttl)
+            for tag_key in tag_keys:
+                pipe.sadd(tag_key, self.key)
+                pipe.expire(tag_key, self.ttl)
+            pipe.sadd(KEYS_KEY, self.key, *tag_keys)
+            pipe.expire(KEYS_KEY, self.ttl)
+            await pipe.execute()
+
+async def get_response_cache(
+    request: Request, r: redis.Redis = Depends(get_redis), db: AsyncSession = Depends(get_read_db)
+) -> ResponseCache:
+    # Same session as the handler's, get_read_db runs once per request
+    replica = db.get_bind() is not engine.sync_engine
+    return ResponseCache(request, r, settings.RESPONSE_CACHE_TTL, replica)
+
+async def invalidate_tags(r: redis.Redis, *tags: str) -> None:
+    """Drop every cached response registered under any of `tags`."""
+    tag_keys = [TAG_PREFIX + tag for tag in tags]
+    try:
+        # Bumped first: entries stored from here on were read after the write
+        async with r.pipeline(transaction=True) as pipe:
+            pipe.incr(GENERATION_KEY)
+            pipe.set(INVALIDATED_AT_KEY, time.time())
+            for tag_key in tag_keys:
+                pipe.smembers(tag_key)
+            members = (await pipe.execute())[2:]
+
+        # SREM only what was read, entries cached meanwhile keep their tag
+        async with r.pipeline(transaction=False) as pipe:
+            keys = set().union(*members)
+            if keys:
+                pipe.delete(*keys)
+                pipe.srem(KEYS_KEY, *keys)
+            for tag_key, tag_members in zip(tag_keys, members):
+                if tag_members:
+                    pipe.srem(tag_key, *tag_members)
+            await pipe.execute()
+    except redis.RedisError:
+        logger.warning('Could not invalidate cached responses for %s', tags, exc_info=True)
+
+async def invalidate_all(r: redis.Redis) -> None:
+    try:
+        async with r.pipeline(transaction=True) as pipe:
+            pipe.incr(GENERATION_KEY)
+            pipe.set(INVALIDATED_AT_KEY, time.time())
+            pipe.smembers(KEYS_KEY)
+            _, _, keys = await pipe.execute()
+        if keys:
+            async with r.pipeline(transaction=False) as pipe:
+                pipe.delete(*keys)
+                pipe.srem(KEYS_KEY, *keys)
+                await pipe.execute()
+    except redis.RedisError:
+        logger.warning('Could not clear cached responses', exc_info=True)
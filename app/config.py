@@ -1,3 +1,6 @@
+from typing import List
+
+from pydantic import model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -12,18 +15,73 @@ class Settings(BaseSettings):
 
     BASE_URL: str
 
-    DATABASE_HOST: str
-    DATABASE_PORT: str
-    DATABASE_NAME: str
-    DATABASE_USER: str
-    DATABASE_PASS: str
+    # Full SQLAlchemy URL, replaces the DATABASE_* connection settings when given
+    DATABASE_URL: str | None = None
+    DATABASE_HOST: str | None = None
+    DATABASE_PORT: str | None = None
+    DATABASE_NAME: str | None = None
+    DATABASE_USER: str | None = None
+    DATABASE_PASS: str | None = None
+
+    DATABASE_ECHO: bool = False
+    DATABASE_POOL_SIZE: int = 10
+    DATABASE_MAX_OVERFLOW: int = 10
+    DATABASE_POOL_TIMEOUT: float = 30.0
+    DATABASE_POOL_RECYCLE: int = 1800
+    DATABASE_POOL_PRE_PING: bool = True
+    DATABASE_STATEMENT_TIMEOUT: int = 0  # milliseconds, 0 disables it
+
+    # Read replicas as a JSON list of URLs, read-only handlers are spread over them
+    DATABASE_REPLICA_URLS: List[str] = []
+    DATABASE_REPLICA_CHECK_INTERVAL: float = 10.0
+    DATABASE_REPLICA_RETRY_SECONDS: float = 30.0
+    DATABASE_REPLICA_LAG_SECONDS: int = 5  # reads stay on the primary this long after a write
 
     JWT_SECRET_KEY: str # openssl rand -hex 32
     JWT_ALGORITHM: str = 'HS256'
     JWT_EXPIRE_MINUTES: int = 30
 
+    PASSWORD_HASH_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_PENDING: int = 64
+
+    USER_CACHE_ENABLED: bool = True
+    USER_CACHE_TTL: int = 60
+    USER_CACHE_MAXSIZE: int = 10000
+
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_TTL: int = 300
+
+    # List endpoints skip ORM objects and Pydantic models, JSON is encoded with orjson.
+    # The default response class follows it at startup only, see app.main
+    FAST_SERIALIZATION_ENABLED: bool = False
+
+    # Request latency, SQL and Redis usage per route at /metrics
+    METRICS_ENABLED: bool = True
+
+    RECIPE_INDEX_ENABLED: bool = True
+    SEARCH_INDEX_ENABLED: bool = True
+    SEARCH_INDEX_PATH: str = 'search_index.pkl'
+
+    IMAGE_DIRECTORY: str = 'app/static/images'
+    IMAGE_MAX_SIZE: int = 10 * 1024 * 1024
+    IMAGE_VARIANTS_ENABLED: bool = True
+    IMAGE_WORKERS: int = 2
+
     REDIS_HOST: str
     REDIS_PORT: int
     REDIS_PASS: str
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_POOL_TIMEOUT: int = 5
+    REDIS_SOCKET_TIMEOUT: float = 2.0
+    REDIS_CONNECT_TIMEOUT: float = 2.0
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30
+
+    @model_validator(mode='after')
+    def check_database_settings(self) -> 'Settings':
+        connection = (self.DATABASE_HOST, self.DATABASE_PORT, self.DATABASE_NAME, self.DATABASE_USER, self.DATABASE_PASS)
+        if not self.DATABASE_URL and any(value is None for value in connection):
+            raise ValueError('Set DATABASE_URL or every DATABASE_HOST/PORT/NAME/USER/PASS setting')
+        return self
 
 settings = Settings()
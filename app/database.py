@@ -1,13 +1,123 @@
-import redis.asyncio as redis
+import itertools
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, List, Sequence
 
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker, declarative_base
+import redis.asyncio as redis
+from redis.asyncio.client import Pipeline
+from fastapi import Request, Response
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
+from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from app.config import settings 
+from app.metrics import record_redis_call
+
+logger = logging.getLogger(__name__)
+
+# DATABASE_URL overrides the MySQL settings, e.g. sqlite+aiosqlite:///./cookgen.db
+DATABASE_URI = settings.DATABASE_URL or f'mysql+asyncmy://{settings.DATABASE_USER}:{settings.DATABASE_PASS}@{settings.DATABASE_HOST}:{settings.DATABASE_PORT}/{settings.DATABASE_NAME}'
+
+class PoolMetrics:
+    """Time spent waiting for a pooled connection, to size pools per worker count."""
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.buckets = [0] * (len(self.BUCKETS) + 1)
+
+    def record(self, seconds: float, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+            self.buckets[bisect_left(self.BUCKETS, seconds)] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            buckets, total = {}, 0
+            for bound, count in zip((*self.BUCKETS, float('inf')), self.buckets):
+                total += count
+                buckets[str(bound)] = total
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_seconds': round(self.wait_seconds, 6),
+                'max_wait_seconds': round(self.max_wait_seconds, 6),
+                'wait_buckets': buckets,
+            }
+
+# Engine name -> its pool metrics: 'primary' and 'replica0', 'replica1'...
+pool_metrics: Dict[str, PoolMetrics] = {}
 
-DATABASE_URI = f'mysql+asyncmy://{settings.DATABASE_USER}:{settings.DATABASE_PASS}@{settings.DATABASE_HOST}:{settings.DATABASE_PORT}/{settings.DATABASE_NAME}'
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+    metrics = PoolMetrics()
 
-engine = create_async_engine(DATABASE_URI, echo=True, future=True, pool_pre_ping=True)
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record(time.perf_counter() - started, timed_out=True)
+            raise
+        self.metrics.record(time.perf_counter() - started)
+        return connection
+
+def metered_pool(name: str) -> type:
+    """MeteredQueuePool recording into pool_metrics[name], kept when the engine recreates its pool."""
+    return type(MeteredQueuePool.__name__, (MeteredQueuePool,), {'metrics': pool_metrics[name]})
+
+def engine_options(url: str, name: str = 'primary') -> Dict[str, Any]:
+    pool_metrics.setdefault(name, PoolMetrics())
+    options = {
+        'echo': settings.DATABASE_ECHO,
+        'pool_pre_ping': settings.DATABASE_POOL_PRE_PING,
+        'pool_recycle': settings.DATABASE_POOL_RECYCLE,
+    }
+    # SQLite stand-ins keep the pool SQLAlchemy picks for them
+    if make_url(url).get_backend_name() != 'sqlite':
+        options.update(
+            poolclass=metered_pool(name),
+            pool_size=settings.DATABASE_POOL_SIZE,
+            max_overflow=settings.DATABASE_MAX_OVERFLOW,
+            pool_timeout=settings.DATABASE_POOL_TIMEOUT,
+        )
+    return options
+
+engine = create_async_engine(DATABASE_URI, **engine_options(DATABASE_URI))
+
+if settings.DATABASE_STATEMENT_TIMEOUT and engine.dialect.name == 'mysql':
+    @event.listens_for(engine.sync_engine, 'connect')
+    def set_statement_timeout(dbapi_connection, connection_record):
+        # MySQL aborts SELECT statements running longer than this
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'SET SESSION max_execution_time = {int(settings.DATABASE_STATEMENT_TIMEOUT)}')
+        cursor.close()
+
+def pool_status() -> Dict[str, Dict[str, Any]]:
+    """Pool usage and checkout waits of the primary and of every replica, by engine name."""
+    engines = {'primary': engine, **{
+        replica_name(index): replica for index, replica in enumerate(replica_router.engines)
+    }}
+    status = {}
+    for name, async_engine in engines.items():
+        pool = async_engine.pool
+        status[name] = {'pool': type(pool).__name__, **pool_metrics[name].snapshot()}
+        if isinstance(pool, AsyncAdaptedQueuePool):
+            status[name].update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+    return status
 
 AsyncSessionLocal = sessionmaker(
     bind=engine, class_=AsyncSession, expire_on_commit=False
@@ -15,13 +125,141 @@ AsyncSessionLocal = sessionmaker(
 
 Base = declarative_base()
 
-async def get_db() -> AsyncSession:
-    db = AsyncSessionLocal()
+# Read replicas
+PRIMARY_COOKIE = 'read_primary'
+
+def replica_name(index: int) -> str:
+    return f'replica{index}'
+
+class ReplicaRouter:
+    """Round-robin over replica engines, skipping the ones that failed a recent health check."""
+
+    def __init__(self):
+        self.engines: List[AsyncEngine] = []
+        self._turn = itertools.count()
+        self._checked_at: Dict[int, float] = {}
+        self._down_until: Dict[int, float] = {}
+
+    def configure(self, urls: Sequence[str]) -> None:
+        self.engines = [
+            create_async_engine(url, **engine_options(url, replica_name(index))) for index, url in enumerate(urls)
+        ]
+        self._checked_at.clear()
+        self._down_until.clear()
+
+    async def dispose(self) -> None:
+        for replica in self.engines:
+            await replica.dispose()
+
+    def mark_down(self, replica: AsyncEngine) -> None:
+        index = self.engines.index(replica)
+        self._checked_at.pop(index, None)
+        self._down_until[index] = time.monotonic() + settings.DATABASE_REPLICA_RETRY_SECONDS
+        logger.warning('Database replica %s is down, reading from the primary', replica.url)
+
+    async def _is_healthy(self, index: int) -> bool:
+        now = time.monotonic()
+        if self._down_until.get(index, 0) > now:
+            return False
+        # Checked at most once per interval, most requests pick a replica without a round trip
+        if now - self._checked_at.get(index, float('-inf')) < settings.DATABASE_REPLICA_CHECK_INTERVAL:
+            return True
+        try:
+            async with self.engines[index].connect() as conn:
+                await conn.exec_driver_sql('SELECT 1')
+        except (exc.SQLAlchemyError, OSError):
+            self.mark_down(self.engines[index])
+            return False
+        self._checked_at[index] = now
+        return True
+
+    async def choose(self) -> AsyncEngine | None:
+        """Next healthy replica, None when every replica is down."""
+        for _ in range(len(self.engines)):
+            index = next(self._turn) % len(self.engines)
+            if await self._is_healthy(index):
+                return self.engines[index]
+        return None
+
+replica_router = ReplicaRouter()
+replica_router.configure(settings.DATABASE_REPLICA_URLS)
+
+@event.listens_for(Session, 'after_commit')
+def pin_reads_to_primary(session: Session) -> None:
+    # Read-your-writes: the client reads from the primary until replicas caught up
+    response = session.info.get('response')
+    if response is not None and settings.DATABASE_REPLICA_LAG_SECONDS:
+        response.set_cookie(
+            PRIMARY_COOKIE, '1', max_age=settings.DATABASE_REPLICA_LAG_SECONDS, httponly=True, samesite='lax'
+        )
+
+async def get_db(response: Response) -> AsyncSession:
+    db = AsyncSessionLocal(info={'response': response})
+    try:
+        yield db
+    finally:
+        await db.close()
+
+async def get_read_db(request: Request) -> AsyncSession:
+    """Session for read-only handlers: a replica when configured, unless the client wrote recently."""
+    replica = None
+    if replica_router.engines and not request.cookies.get(PRIMARY_COOKIE):
+        replica = await replica_router.choose()
+
+    db = AsyncSessionLocal(bind=replica) if replica is not None else AsyncSessionLocal()
     try:
         yield db
+    except (exc.OperationalError, exc.InterfaceError):
+        # Lost the replica mid-request, the next requests fail over
+        if replica is not None:
+            replica_router.mark_down(replica)
+        raise
     finally:
         await db.close()
 
-async def get_redis():
-    redis_url = f"redis://:{settings.REDIS_PASS}@{settings.REDIS_HOST}:{settings.REDIS_PORT}"
-    return redis.from_url(redis_url)
+# Redis connection pool, shared for the whole app lifetime
+REDIS_URL = f'redis://:{settings.REDIS_PASS}@{settings.REDIS_HOST}:{settings.REDIS_PORT}'
+
+redis_pool: redis.ConnectionPool | None = None
+
+def create_redis_pool() -> redis.ConnectionPool:
+    # Blocking pool: waits up to REDIS_POOL_TIMEOUT for a free connection instead of opening more
+    return redis.BlockingConnectionPool.from_url(
+        REDIS_URL,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+    )
+
+async def init_redis() -> None:
+    global redis_pool
+    if redis_pool is None:
+        redis_pool = create_redis_pool()
+
+async def close_redis() -> None:
+    global redis_pool
+    if redis_pool is not None:
+        await redis_pool.disconnect()
+        redis_pool = None
+
+# Count round trips per request: one per command, one per executed pipeline
+class MeteredPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        record_redis_call()
+        return await super().execute(raise_on_error)
+
+class MeteredRedis(redis.Redis):
+    async def execute_command(self, *args, **options):
+        record_redis_call()
+        return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint: str | None = None) -> MeteredPipeline:
+        return MeteredPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+async def get_redis() -> redis.Redis:
+    # Outside the app lifespan (scripts, shell) the pool is created on first use
+    if redis_pool is None:
+        await init_redis()
+    return MeteredRedis(connection_pool=redis_pool)
@@ -0,0 +1,120 @@
+# Streaming bulk ingredient loader
+import argparse
+import asyncio
+import csv
+import logging
+import time
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Ingredient
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 5000
+NAME_MAX_LENGTH = Ingredient.__table__.c.name.type.length
+
+def upsert_ingredients_statement(dialect_name: str):
+    """INSERT that updates the description when the ingredient name already exists and has the same author."""
+    if dialect_name == 'mysql':
+        stmt = mysql.insert(Ingredient)
+        return stmt.on_duplicate_key_update(description=func.if_(
+            Ingredient.author_id == stmt.inserted.author_id, stmt.inserted.description, Ingredient.description
+        ))
+
+    # SQLite / PostgreSQL stand-ins
+    dialect = sqlite if dialect_name == 'sqlite' else postgresql
+    stmt = dialect.insert(Ingredient)
+    return stmt.on_conflict_do_update(
+        index_elements=['name'],
+        set_={'description': stmt.excluded.description},
+        where=Ingredient.author_id == stmt.excluded.author_id
+    )
+
+async def drop_foreign_rows(db: AsyncSession, rows: List[Dict[str, Any]], author_id: int) -> List[Dict[str, Any]]:
+    """Leave out rows naming an ingredient of another author, those are never updated."""
+    names = [row['name'] for row in rows]
+    result = await db.execute(select(Ingredient.name).where(Ingredient.name.in_(names), Ingredient.author_id != author_id))
+    # Unique names may compare case-insensitively
+    foreign = {name.lower() for name in result.scalars()}
+    if not foreign:
+        return rows
+    return [row for row in rows if row['name'].lower() not in foreign]
+
+def read_chunk(reader: Iterator[Dict[str, str]], size: int, author_id: int) -> Tuple[List[Dict[str, Any]], int, int]:
+    """Next `size` CSV rows as insert parameters, plus the number of rows read and skipped."""
+    rows, read, skipped = [], 0, 0
+    for row in islice(reader, size):
+        read += 1
+        name = (row.get('name') or '').strip()
+        if not name or len(name) > NAME_MAX_LENGTH:
+            skipped += 1
+            continue
+        rows.append({'name': name, 'description': row.get('description') or None, 'author_id': author_id})
+    return rows, read, skipped
+
+async def load_ingredients(
+    db: AsyncSession,
+    reader: Iterator[Dict[str, str]],
+    author_id: int,
+    chunk_size: int = CHUNK_SIZE
+) -> Dict[str, Any]:
+    """
+    Upsert ingredients from CSV rows (`name`, `description`) chunk by chunk.
+
+    Rows are read off the event loop and each chunk is one executemany INSERT committed on
+    its own, so memory stays constant whatever the size of the file. Ingredients of other
+    authors are left untouched and counted as skipped.
+    """
+    stmt = upsert_ingredients_statement(db.get_bind().dialect.name)
+    started = time.perf_counter()
+    loaded = skipped = chunks = 0
+
+    while True:
+        rows, read, chunk_skipped = await asyncio.to_thread(read_chunk, reader, chunk_size, author_id)
+        if not read:
+            break
+        if rows:
+            kept = await drop_foreign_rows(db, rows, author_id)
+            chunk_skipped += len(rows) - len(kept)
+            rows = kept
+        if rows:
+            await db.execute(stmt, rows)
+            await db.commit()
+
+        loaded += len(rows)
+        skipped += chunk_skipped
+        chunks += 1
+        elapsed = time.perf_counter() - started
+        logger.info('Loaded %d ingredients (%d skipped) in %.1fs, %.0f rows/s', loaded, skipped, elapsed, loaded / elapsed)
+
+    seconds = time.perf_counter() - started
+    return {
+        'loaded': loaded,
+        'skipped': skipped,
+        'chunks': chunks,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(loaded / seconds, 1) if seconds else 0.0,
+    }
+
+async def main(csv_path: str, author_id: int, chunk_size: int) -> None:
+    from app.database import AsyncSessionLocal
+
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        async with AsyncSessionLocal() as db:
+            stats = await load_ingredients(db, csv.DictReader(f), author_id, chunk_size)
+    logger.info('Done: %s', stats)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load or update ingredients from a CSV file (name, description)')
+    parser.add_argument('csv_path')
+    parser.add_argument('--author-id', type=int, default=1)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    asyncio.run(main(args.csv_path, args.author_id, args.chunk_size))
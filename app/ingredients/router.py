@@ -1,32 +1,72 @@
-from fastapi import APIRouter, Depends, HTTPException
+import csv
+import io
+
+import redis.asyncio as redis
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile
+from fastapi_pagination.api import resolve_params
 from fastapi_pagination.links import Page
 from fastapi_pagination.ext.async_sqlalchemy import paginate
-from sqlalchemy import select
+from sqlalchemy import func, select
 from sqlalchemy.orm import joinedload
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import get_db
-from app.models import Ingredient, User
-from app.schemas import IngredientRead, IngredientCreate, IngredientUpdate
+from app.config import settings
+from app.database import get_db, get_read_db, get_redis
+from app.cache import ResponseCache, get_response_cache, invalidate_tags, invalidate_all, ingredient_tag, INGREDIENTS_TAG, RECIPES_TAG
+from app.pagination import CursorPage, keyset_paginate
+from app.models import Ingredient, User, recipe_ingredient_association
+from app.schemas import IngredientRead, IngredientCreate, IngredientUpdate, IngredientLoadResult
 from app.ingredients.dependencies import get_ingredient_by_id
+from app.ingredients.loader import load_ingredients
 from app.auth.dependencies import get_current_user
+from app.recipes.search import text_index
+from app.recipes.sync import index_sync
+from app.recipes.utils import INGREDIENT_COLUMNS
+from app.serialization import dumps, page_content
 
 router = APIRouter(prefix='/ingredients', tags=['ingredients'], responses={404: {'description': 'Not found'}})
 
 @router.get('/', status_code=200, response_model=Page[IngredientRead])
-async def get_ingredients(db: AsyncSession = Depends(get_db)):
+async def get_ingredients(cache: ResponseCache = Depends(get_response_cache), db: AsyncSession = Depends(get_read_db)):
+    if (response := await cache.get()) is not None:
+        return response
+
+    # Opt-in: plain rows to orjson, no ORM objects nor Pydantic validation
+    if settings.FAST_SERIALIZATION_ENABLED:
+        params = resolve_params()
+        raw_params = params.to_raw_params().as_limit_offset()
+        total = await db.scalar(select(func.count(Ingredient.id)))
+        result = await db.execute(
+            select(*INGREDIENT_COLUMNS).order_by(Ingredient.name).limit(raw_params.limit).offset(raw_params.offset)
+        )
+        items = [dict(row) for row in result.mappings()]
+        return await cache.set(dumps(page_content(items, total, params)), [INGREDIENTS_TAG])
+
     query = select(Ingredient).options(joinedload(Ingredient.recipes)).order_by(Ingredient.name)
     data = await paginate(db, query)
-    return data
+    return await cache.set(data, [INGREDIENTS_TAG])
+
+@router.get('/cursor', status_code=200, response_model=CursorPage[IngredientRead])
+async def get_ingredients_by_cursor(
+    cursor: str | None = None,
+    size: int = Query(50, ge=1, le=100),
+    db: AsyncSession = Depends(get_read_db)
+):
+    return await keyset_paginate(db, select(Ingredient), [Ingredient.name, Ingredient.id], cursor, size)
 
 @router.get('/{id}', status_code=200, response_model=IngredientRead)
-async def get_ingredient(ingredient: Ingredient = Depends(get_ingredient_by_id)):
-    return ingredient
+async def get_ingredient(id: int, cache: ResponseCache = Depends(get_response_cache), db: AsyncSession = Depends(get_read_db)):
+    if (response := await cache.get()) is not None:
+        return response
+
+    ingredient = await get_ingredient_by_id(id, db)
+    return await cache.set(IngredientRead.model_validate(ingredient, from_attributes=True), [ingredient_tag(ingredient.id)])
 
 @router.post('/', status_code=201, response_model=IngredientRead)
 async def create_ingredient(
     ingredient: IngredientCreate,
     db: AsyncSession = Depends(get_db),
+    r: redis.Redis = Depends(get_redis),
     current_user: User = Depends(get_current_user)
 ):
     # Create new ingredient
@@ -37,14 +77,38 @@ async def create_ingredient(
     db.add(new_ingredient)
     await db.commit()
     await db.refresh(new_ingredient)
+    await invalidate_tags(r, INGREDIENTS_TAG)
 
     return new_ingredient
 
+@router.post('/bulk', status_code=200, response_model=IngredientLoadResult, description='Create/Update ingredients from a CSV file')
+async def load_ingredients_csv(
+    csv_file: UploadFile,
+    db: AsyncSession = Depends(get_db),
+    r: redis.Redis = Depends(get_redis),
+    current_user: User = Depends(get_current_user)
+):
+    author_id = current_user.id
+
+    # Stream the uploaded file, it is never read whole into memory
+    reader = csv.DictReader(io.TextIOWrapper(csv_file.file, encoding='utf-8', newline=''))
+    try:
+        if not reader.fieldnames or 'name' not in reader.fieldnames:
+            raise HTTPException(400, 'CSV file must have a name column')
+        stats = await load_ingredients(db, reader, author_id)
+    except UnicodeDecodeError:
+        raise HTTPException(400, 'CSV file must be UTF-8 encoded')
+    finally:
+        # Any ingredient, and so any recipe, may have changed
+        await invalidate_all(r)
+    return stats
+
 @router.put('/{id}', status_code=200, response_model=IngredientRead)
 async def update_ingredient(
     ingredient_data: IngredientUpdate,
     ingredient: Ingredient = Depends(get_ingredient_by_id),
     db: AsyncSession = Depends(get_db),
+    r: redis.Redis = Depends(get_redis),
     current_user: User = Depends(get_current_user)
 ):
     # Check if is owner
@@ -56,8 +120,16 @@ async def update_ingredient(
         if value is not None:
             setattr(ingredient, field, value)
 
+    # Set values stay loaded after the commit, no refresh needed
     await db.commit()
-    await db.refresh(ingredient)
+
+    # Recipes embed their ingredients
+    await invalidate_tags(r, INGREDIENTS_TAG, RECIPES_TAG, ingredient_tag(ingredient.id))
+
+    # Recipes are searchable by ingredient name
+    if ingredient_data.name is not None:
+        text_index.set_ingredient(ingredient.id, ingredient.name)
+        await index_sync.publish(r, ingredients=[ingredient.id])
 
     return ingredient
 
@@ -65,14 +137,24 @@ async def update_ingredient(
 async def delete_ingredient(
     ingredient: Ingredient = Depends(get_ingredient_by_id),
     db: AsyncSession = Depends(get_db),
+    r: redis.Redis = Depends(get_redis),
     current_user: User = Depends(get_current_user)
 ):
     # Check if is owner
     if not ingredient.author_id == current_user.id:
         raise HTTPException(403, 'Not authorized to delete this ingredient')
 
+    # Recipes that used it lose an ingredient
+    link = recipe_ingredient_association.c
+    recipe_ids = (await db.scalars(select(link.recipe_id).where(link.ingredient_id == ingredient.id))).all()
+
     await db.delete(ingredient)
     await db.commit()
+    await invalidate_tags(r, INGREDIENTS_TAG, RECIPES_TAG, ingredient_tag(ingredient.id))
+
+    # Same path as the changes of other workers: the ingredient is gone, its recipes are reloaded
+    await index_sync.apply(set(recipe_ids), {ingredient.id})
+    await index_sync.publish(r, recipes=recipe_ids, ingredients=[ingredient.id])
 
     return
 
@@ -1,8 +1,10 @@
-import pandas as pd
+import csv
+
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import engine, Base
-from app.models import User, Ingredient
+from app.models import User
 from app.auth.utils import get_hashed_password
+from app.ingredients.loader import load_ingredients
 
 async def init_admin_user(session):
     admin = User(username='admin', email='admin@admin.com', password=get_hashed_password('admin'), full_name='Administrator')
@@ -10,19 +12,8 @@ async def init_admin_user(session):
     await session.commit()
 
 async def load_ingredients_from_csv(session, csv_path):
-    df = pd.read_csv(csv_path, encoding='utf8')
-
-    df['name'] = df['name'].astype(str).apply(lambda x: x.encode('utf-8'))
-    df['description'] = df['description'].astype(str).apply(lambda x: x.encode('utf-8'))
-
-    for _, row in df.iterrows():
-        ingredient = Ingredient(
-            name=row['name'],
-            description=row['description'],
-            author_id=1
-        )
-        session.add(ingredient)
-    await session.commit()
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        await load_ingredients(session, csv.DictReader(f), author_id=1)
 
 async def main():
     async with engine.begin() as conn:
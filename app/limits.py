@@ -0,0 +1,46 @@
+# Request body size limits, enforced before the body is parsed
+import re
+from typing import Iterable
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+
+class BodySizeLimitMiddleware:
+    """
+    ASGI middleware rejecting bodies above `max_size` bytes on the routes matching `path`.
+
+    A larger Content-Length is answered with 413 before anything is read. Otherwise the body
+    is counted as it streams in and reading stops with a 413 once it goes over, so an oversized
+    upload is never spooled to disk in full.
+    """
+
+    def __init__(self, app, max_size: int, path: str, methods: Iterable[str] = ('POST', 'PUT', 'PATCH')):
+        self.app = app
+        self.max_size = max_size
+        self.path = re.compile(path)
+        self.methods = set(methods)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] not in self.methods or not self.path.fullmatch(scope['path']):
+            return await self.app(scope, receive, send)
+
+        detail = f'Request body exceeds {self.max_size} bytes'
+        content_length = Headers(scope=scope).get('content-length', '')
+        if content_length.isdigit() and int(content_length) > self.max_size:
+            response = JSONResponse({'detail': detail}, status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                # Raised while FastAPI reads the form, which turns it into the response
+                if received > self.max_size:
+                    raise HTTPException(413, detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
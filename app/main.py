@@ -1,16 +1,66 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi_pagination import add_pagination
 
 from app.config import settings
+from app.metrics import MetricsMiddleware, render, render_pool
+from app.limits import BodySizeLimitMiddleware
+from app.database import AsyncSessionLocal, init_redis, close_redis, get_redis, pool_status, replica_router
+from app.recipes.utils import build_indexes, save_indexes
+from app.recipes.images import start_image_executor, stop_image_executor
+from app.auth.utils import stop_password_executor
+from app.recipes.static import ImageStaticFiles
+from app.recipes.constants import IMAGE_FORM_OVERHEAD
 from app.auth.router import router as auth_router
 from app.recipes.router import router as recipes_router
 from app.ingredients.router import router as ingredients_router
 from app.users.router import router as users_router
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Shared Redis connection pool for the app lifetime
+    await init_redis()
+
+    # In-memory search indexes
+    async with AsyncSessionLocal() as db:
+        await build_indexes(db, await get_redis())
+
+    # Process pool for image resizing
+    if settings.IMAGE_VARIANTS_ENABLED:
+        start_image_executor(settings.IMAGE_WORKERS)
+
+    yield
+
+    stop_image_executor()
+    stop_password_executor()
+    async with AsyncSessionLocal() as db:
+        await save_indexes(db)
+    await close_redis()
+    await replica_router.dispose()
 
-# Mount static file
+# Chosen once at import: switching FAST_SERIALIZATION_ENABLED at runtime changes the list
+# endpoints but not the class of the other responses
+app = FastAPI(
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse if settings.FAST_SERIALIZATION_ENABLED else JSONResponse
+)
+
+# Per route latency, SQL and Redis usage, served at /metrics
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+# Oversized image uploads are rejected before the form is spooled to disk
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_size=settings.IMAGE_MAX_SIZE + IMAGE_FORM_OVERHEAD,
+    path=r'/recipes/\d+/image'
+)
+
+# Mount static file, recipe images get immutable caching headers
+app.mount('/static/images', ImageStaticFiles(directory=settings.IMAGE_DIRECTORY), name='images')
 app.mount('/static', StaticFiles(directory='app/static'), name='static')
 
 # Routers
@@ -24,5 +74,17 @@ app.include_router(users_router)
 async def root():
     return {'message': f'Welcome to {settings.APP_NAME}'}
 
+# Connection pool usage and checkout wait times of the primary and every replica
+@app.get('/health', tags=['root'])
+async def health():
+    return {'status': 'ok', 'database_pools': pool_status()}
+
+# Prometheus text format, not there when metrics are disabled
+@app.get('/metrics', tags=['root'], include_in_schema=False)
+async def metrics():
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(404, 'Not Found')
+    return PlainTextResponse(render(render_pool(pool_status())), media_type='text/plain; version=0.0.4')
+
 # Add pagination
 add_pagination(app)
\ No newline at end of file
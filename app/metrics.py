@@ -0,0 +1,189 @@
+# Request, SQL, Redis and connection pool metrics in the Prometheus text format
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], int] = {}
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: int = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = list(self._values.items())
+        lines.extend(f'{self.name}{_labels(self.labels, labels)} {value}' for labels, value in values)
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # labels -> [count per bucket..., count above the last bucket, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(labels, list(values)) for labels, values in self._series.items()]
+        for labels, values in series:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), values):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, labels)} {_number(values[-1])}')
+            lines.append(f'{self.name}_count{_labels(self.labels, labels)} {cumulative}')
+        return lines
+
+# Per request totals, filled by the SQLAlchemy and Redis hooks
+class RequestStats:
+    __slots__ = ('statements', 'db_seconds', 'redis_calls')
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.redis_calls = 0
+
+request_stats: ContextVar[RequestStats | None] = ContextVar('request_stats', default=None)
+
+ROUTE_LABELS = ('method', 'route')
+
+http_requests = Counter('http_requests_total', 'HTTP requests.', ('method', 'route', 'status'))
+http_duration = Histogram('http_request_duration_seconds', 'HTTP request latency.', ROUTE_LABELS)
+db_statements = Histogram('db_statements_per_request', 'SQL statements per request.', ROUTE_LABELS, COUNT_BUCKETS)
+db_duration = Histogram('db_duration_seconds_per_request', 'Time spent in SQL statements per request.', ROUTE_LABELS)
+redis_calls = Histogram('redis_round_trips_per_request', 'Redis round trips per request.', ROUTE_LABELS, COUNT_BUCKETS)
+
+REQUEST_METRICS = (http_requests, http_duration, db_statements, db_duration, redis_calls)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if request_stats.get() is not None:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = request_stats.get()
+    if stats is not None and conn.info.get('query_started'):
+        stats.statements += 1
+        stats.db_seconds += time.perf_counter() - conn.info['query_started'].pop()
+
+def record_redis_call() -> None:
+    stats = request_stats.get()
+    if stats is not None:
+        stats.redis_calls += 1
+
+def route_name(scope) -> str:
+    # Path templates only, raw paths would give one series per id
+    route = scope.get('route')
+    return getattr(route, 'path', None) or 'unmatched'
+
+class MetricsMiddleware:
+    """ASGI middleware timing each request and collecting what its SQL and Redis hooks counted."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            request_stats.reset(token)
+            labels = (scope['method'], route_name(scope))
+            http_requests.inc((*labels, str(status)))
+            http_duration.observe(labels, elapsed)
+            db_statements.observe(labels, stats.statements)
+            db_duration.observe(labels, stats.db_seconds)
+            redis_calls.observe(labels, stats.redis_calls)
+
+def render_pool(status: Dict[str, Dict]) -> List[str]:
+    """Pool gauges and the checkout wait histogram of every engine from app.database.pool_status()."""
+    def engine_labels(engine: str, extra: str = '') -> str:
+        return _labels(('engine',), (engine,), extra)
+
+    lines = []
+    for key, name, documentation in (
+        ('size', 'db_pool_size', 'Connections kept in the pool.'),
+        ('checked_out', 'db_pool_checked_out', 'Connections in use.'),
+        ('overflow', 'db_pool_overflow', 'Connections opened above the pool size.'),
+    ):
+        values = [(engine, pool[key]) for engine, pool in status.items() if key in pool]
+        if values:
+            lines += [f'# HELP {name} {documentation}', f'# TYPE {name} gauge']
+            lines += [f'{name}{engine_labels(engine)} {value}' for engine, value in values]
+
+    lines += [
+        '# HELP db_pool_checkout_timeouts_total Checkouts that gave up waiting for a connection.',
+        '# TYPE db_pool_checkout_timeouts_total counter',
+        *(f'db_pool_checkout_timeouts_total{engine_labels(engine)} {pool["timeouts"]}' for engine, pool in status.items()),
+        '# HELP db_pool_checkout_wait_seconds Time waited for a pooled connection.',
+        '# TYPE db_pool_checkout_wait_seconds histogram',
+    ]
+    for engine, pool in status.items():
+        count = 0
+        for bound, count in pool['wait_buckets'].items():
+            le = 'le="+Inf"' if bound == 'inf' else f'le="{bound}"'
+            lines.append(f'db_pool_checkout_wait_seconds_bucket{engine_labels(engine, le)} {count}')
+        lines.append(f'db_pool_checkout_wait_seconds_sum{engine_labels(engine)} {_number(pool["wait_seconds"])}')
+        lines.append(f'db_pool_checkout_wait_seconds_count{engine_labels(engine)} {count}')
+    return lines
+
+def render(extra: Iterable[str] = ()) -> str:
+    lines = [line for metric in REQUEST_METRICS for line in metric.render()]
+    lines.extend(extra)
+    return '\n'.join(lines) + '\n'
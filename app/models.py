@@ -1,18 +1,21 @@
 # Global models
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Table, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Table, Boolean, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
 from app.database import Base
 
+# Composite primary keys serve lookups by the first column, the extra index the reverse direction
 recipe_ingredient_association = Table('recipe_ingredient', Base.metadata,
-    Column('recipe_id', Integer, ForeignKey('recipes.id')),
-    Column('ingredient_id', Integer, ForeignKey('ingredients.id'))
+    Column('recipe_id', Integer, ForeignKey('recipes.id'), primary_key=True),
+    Column('ingredient_id', Integer, ForeignKey('ingredients.id'), primary_key=True),
+    Index('ix_recipe_ingredient_ingredient_id', 'ingredient_id')
 )
 
 user_saved_recipes = Table('user_saved_recipes', Base.metadata,
-    Column('user_id', Integer, ForeignKey('users.id')),
-    Column('recipe_id', Integer, ForeignKey('recipes.id'))
+    Column('user_id', Integer, ForeignKey('users.id'), primary_key=True),
+    Column('recipe_id', Integer, ForeignKey('recipes.id'), primary_key=True),
+    Index('ix_user_saved_recipes_recipe_id', 'recipe_id')
 )
 
 class User(Base):
@@ -56,7 +59,10 @@ class Recipe(Base):
     author_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     instructions = Column(Text, nullable=False)
     image_name = Column(String(255), nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    image_extension = Column(String(10), nullable=True)
+    image_size = Column(Integer, nullable=True)
+    image_hash = Column(String(64), nullable=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     low_carb = Column(Boolean, default=False)
     gluten_free = Column(Boolean, default=False)
@@ -70,11 +76,15 @@ class Recipe(Base):
 
 class UserPreference(Base):
     __tablename__ = 'user_preferences'
+    __table_args__ = (
+        # One preference per ingredient, also the index for a user's preferences
+        UniqueConstraint('user_id', 'ingredient_id', name='uq_user_preferences_user_ingredient'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     preference_type = Column(String(50), nullable=False)  # 'allergy', 'like', 'dislike'
-    ingredient_id = Column(Integer, ForeignKey('ingredients.id'), nullable=False)
+    ingredient_id = Column(Integer, ForeignKey('ingredients.id'), nullable=False, index=True)
 
     user = relationship('User', back_populates='preferences')
     ingredient = relationship('Ingredient')
\ No newline at end of file
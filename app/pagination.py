@@ -0,0 +1,109 @@
+# Keyset (cursor) pagination
+import base64
+import json
+from datetime import datetime
+from typing import Any, Callable, Generic, List, Sequence, Tuple, TypeVar
+
+from fastapi import HTTPException
+from fastapi_pagination.api import create_page
+from fastapi_pagination.utils import verify_params
+from pydantic import BaseModel
+from sqlalchemy import DateTime, Select, and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import InstrumentedAttribute
+
+T = TypeVar('T')
+
+class CursorPage(BaseModel, Generic[T]):
+    items: List[T]
+    next_cursor: str | None = None
+    prev_cursor: str | None = None
+
+def encode_cursor(values: Sequence[Any], backwards: bool = False) -> str:
+    raw = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    data = json.dumps({'k': raw, 'b': backwards}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str, keys: Sequence[InstrumentedAttribute]) -> Tuple[List[Any], bool]:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        raw, backwards = data['k'], bool(data['b'])
+        if len(raw) != len(keys):
+            raise ValueError('Cursor does not match sort keys')
+        values = [
+            datetime.fromisoformat(v) if isinstance(key.type, DateTime) else v
+            for key, v in zip(keys, raw)
+        ]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+    return values, backwards
+
+def _keyset_condition(keys: Sequence[InstrumentedAttribute], values: Sequence[Any], backwards: bool):
+    # (a, b) > (x, y)  ->  a > x OR (a = x AND b > y), written out so MySQL can use the index
+    clauses = []
+    for i, key in enumerate(keys):
+        equal = [k == v for k, v in zip(keys[:i], values[:i])]
+        bound = key < values[i] if backwards else key > values[i]
+        clauses.append(and_(*equal, bound))
+    return or_(*clauses)
+
+async def keyset_paginate(
+    db: AsyncSession,
+    query: Select,
+    keys: Sequence[InstrumentedAttribute],
+    cursor: str | None = None,
+    size: int = 50
+) -> CursorPage:
+    values, backwards = decode_cursor(cursor, keys) if cursor else (None, False)
+
+    if values is not None:
+        query = query.where(_keyset_condition(keys, values, backwards))
+    order = [key.desc() if backwards else key.asc() for key in keys]
+
+    # Fetch one extra row to know if there is another page in this direction
+    result = await db.execute(query.order_by(*order).limit(size + 1))
+    items = list(result.scalars().all())
+    has_more = len(items) > size
+    items = items[:size]
+    if backwards:
+        items.reverse()
+
+    def row_key(item) -> List[Any]:
+        return [getattr(item, key.key) for key in keys]
+
+    next_cursor = prev_cursor = None
+    if items:
+        if has_more or backwards:
+            next_cursor = encode_cursor(row_key(items[-1]))
+        if (has_more and backwards) or (values is not None and not backwards):
+            prev_cursor = encode_cursor(row_key(items[0]), backwards=True)
+
+    return CursorPage(items=items, next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+async def paginate_ids(
+    db: AsyncSession,
+    query: Select,
+    key: InstrumentedAttribute,
+    ids: Sequence[int],
+    total: int | None = None,
+    transformer: Callable[[List[Any]], List[Any]] | None = None
+) -> Any:
+    """
+    Offset-paginate an already ordered list of primary keys, loading only the current page.
+
+    `ids` may be just the first offset + limit keys when `total` is given. `transformer`
+    is applied to the loaded page items.
+    """
+    params, raw_params = verify_params(None, 'limit-offset')
+    page_ids = [int(i) for i in ids[raw_params.as_slice()]]
+
+    items = []
+    if page_ids:
+        result = await db.execute(query.where(key.in_(page_ids)))
+        by_id = {getattr(item, key.key): item for item in result.scalars().unique()}
+        items = [by_id[i] for i in page_ids if i in by_id]
+    if transformer is not None:
+        items = transformer(items)
+
+    return create_page(items, total=len(ids) if total is None else total, params=params)
@@ -0,0 +1,15 @@
+# Bulk recipe creation
+BULK_CREATE_MAX_ITEMS = 5000
+BULK_CREATE_CHUNK_SIZE = 500
+
+# Changes kept for other workers, one further behind rebuilds its indexes
+INDEX_CHANGES_MAXLEN = 10000
+
+# Recipe images
+IMAGE_CHUNK_SIZE = 64 * 1024
+# Room for the multipart boundaries and part headers around the image
+IMAGE_FORM_OVERHEAD = 64 * 1024
+IMAGE_CONTENT_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp'}
+# Serializes uploads and deletions of the same image across workers
+IMAGE_LOCK_PREFIX = 'image-lock:'
+IMAGE_LOCK_TIMEOUT = 30
@@ -1,14 +1,20 @@
+import redis.asyncio as redis
 from fastapi import HTTPException, Depends
 from sqlalchemy import select
 from sqlalchemy.orm import joinedload
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import get_db
+from app.database import get_db, get_redis
 from app.models import Recipe
+from app.recipes.sync import index_sync
 
 async def get_recipe_by_id(id: int, db: AsyncSession = Depends(get_db)) -> Recipe:
     result = await db.execute(select(Recipe).options(joinedload(Recipe.ingredients)).filter_by(id=id))
     recipe = result.scalars().first()
     if not recipe:
         raise HTTPException(status_code=404, detail='Recipe not found')
-    return recipe
\ No newline at end of file
+    return recipe
+
+async def sync_indexes(r: redis.Redis = Depends(get_redis)) -> None:
+    # Writes made by the other worker processes
+    await index_sync.sync(r)
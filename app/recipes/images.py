@@ -0,0 +1,90 @@
+# Recipe image derivatives, generated in worker processes
+import asyncio
+import logging
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Variant name -> longest edge in pixels
+IMAGE_VARIANTS = {'thumbnail': 150, 'medium': 600, 'large': 1200}
+VARIANT_FORMAT = 'webp'
+
+image_executor: ProcessPoolExecutor | None = None
+
+def start_image_executor(max_workers: int) -> None:
+    global image_executor
+    if image_executor is None:
+        # spawn: never fork the server process with its event loop and thread pools
+        image_executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+def stop_image_executor() -> None:
+    global image_executor
+    if image_executor is not None:
+        image_executor.shutdown(wait=True, cancel_futures=True)
+        image_executor = None
+
+def image_relpath(filename_without_extension: str, extension: str) -> str:
+    """Path of an image inside the images directory, sharded by the first two characters of its name."""
+    return f'{filename_without_extension[:2]}/{filename_without_extension}.{extension}'
+
+def variant_relpath(variant: str, filename_without_extension: str) -> str:
+    return f'{variant}/{image_relpath(filename_without_extension, VARIANT_FORMAT)}'
+
+def variant_path(directory: str, variant: str, filename_without_extension: str) -> str:
+    return os.path.join(directory, variant_relpath(variant, filename_without_extension))
+
+def generate_variants(source_path: str, directory: str, filename_without_extension: str) -> list[str]:
+    """Resize `source_path` into every variant as WebP. Runs in a worker process."""
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+        created = []
+        for variant, max_edge in IMAGE_VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+            path = variant_path(directory, variant, filename_without_extension)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Unique per writer, concurrent uploads of the same image generate the same variants
+            tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+            resized.save(tmp_path, format='WEBP', quality=80, method=4)
+            os.replace(tmp_path, path)
+            created.append(path)
+    return created
+
+async def create_image_variants(directory: str, filename_without_extension: str, extension: str) -> None:
+    """Background task: generate every variant of a saved image in the process pool."""
+    if image_executor is None:
+        return
+    # Content-addressed: a duplicate upload already has its variants
+    loop = asyncio.get_running_loop()
+    existing = await loop.run_in_executor(None, existing_variants, directory, filename_without_extension)
+    if len(existing) == len(IMAGE_VARIANTS):
+        return
+    source_path = os.path.join(directory, image_relpath(filename_without_extension, extension))
+    try:
+        await loop.run_in_executor(image_executor, generate_variants, source_path, directory, filename_without_extension)
+    except Exception:
+        logger.exception('Could not generate image variants for %s', source_path)
+
+def delete_image_variants(directory: str, filename_without_extension: str) -> None:
+    for variant in IMAGE_VARIANTS:
+        path = variant_path(directory, variant, filename_without_extension)
+        if os.path.exists(path):
+            os.remove(path)
+
+def existing_variants(directory: str, filename_without_extension: str) -> dict[str, str]:
+    """Variant name -> path relative to `directory`, for the variants already generated."""
+    variants = {}
+    for variant in IMAGE_VARIANTS:
+        path = variant_path(directory, variant, filename_without_extension)
+        if os.path.exists(path):
+            variants[variant] = variant_relpath(variant, filename_without_extension)
+    return variants
@@ -0,0 +1,303 @@
+# In-memory inverted index of recipes by ingredient
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Set, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Recipe, recipe_ingredient_association
+
+def _timestamp(value: datetime | None) -> float:
+    # created_at is stored as naive UTC
+    if value is None:
+        return 0.0
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+class RecipeIndex:
+    """
+    Maps ingredient ids to the recipes that use them, plus precomputed flag bitmaps.
+
+    Every recipe gets a dense slot. Per-slot data (recipe id, flags, liveness, ingredient
+    count, creation time) lives in NumPy arrays, and each ingredient keeps a sorted array
+    of slots (a roaring-style "array container"), so together the postings are the columns
+    of a sparse recipe x ingredient matrix. Writes are buffered per ingredient and merged lazily on the next
+    read, so incremental updates stay cheap. The index is per process: the write endpoints
+    update it directly and publish their changes, the other workers pick them up through
+    app.recipes.sync before searching.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.ready = False
+        self._slots: Dict[int, int] = {}
+        self._free: list[int] = []
+        self._size = 0
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._live = np.zeros(capacity, dtype=np.bool_)
+        self._gluten_free = np.zeros(capacity, dtype=np.bool_)
+        self._low_carb = np.zeros(capacity, dtype=np.bool_)
+        self._sizes = np.zeros(capacity, dtype=np.int32)
+        self._created = np.zeros(capacity, dtype=np.float64)
+        self._ingredients: Dict[int, Tuple[int, ...]] = {}
+        self._postings: Dict[int, np.ndarray] = {}
+        self._added: Dict[int, Set[int]] = defaultdict(set)
+        self._removed: Dict[int, Set[int]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, recipe_id: int) -> bool:
+        return recipe_id in self._slots
+
+    def _grow(self, capacity: int) -> None:
+        for name in ('_ids', '_live', '_gluten_free', '_low_carb', '_sizes', '_created'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _allocate(self) -> int:
+        if self._free:
+            return self._free.pop()
+        if self._size == len(self._ids):
+            self._grow(max(1024, len(self._ids) * 2))
+        self._size += 1
+        return self._size - 1
+
+    def _posting(self, ingredient_id: int) -> np.ndarray:
+        posting = self._postings.get(ingredient_id)
+        if posting is None:
+            posting = np.empty(0, dtype=np.int32)
+
+        removed = self._removed.pop(ingredient_id, None)
+        added = self._added.pop(ingredient_id, None)
+        if removed:
+            posting = np.setdiff1d(posting, np.fromiter(removed, dtype=np.int32), assume_unique=True)
+        if added:
+            posting = np.union1d(posting, np.fromiter(added, dtype=np.int32))
+        if removed or added:
+            self._postings[ingredient_id] = posting
+        return posting
+
+    def _link(self, slot: int, ingredient_id: int) -> None:
+        self._removed[ingredient_id].discard(slot)
+        self._added[ingredient_id].add(slot)
+
+    def _unlink(self, slot: int, ingredient_id: int) -> None:
+        self._added[ingredient_id].discard(slot)
+        self._removed[ingredient_id].add(slot)
+
+    def add(
+        self,
+        recipe_id: int,
+        ingredient_ids: Iterable[int],
+        gluten_free: bool = False,
+        low_carb: bool = False,
+        created_at: datetime | None = None
+    ) -> None:
+        """Insert a recipe, or update it in place if it is already indexed."""
+        new_ingredients = tuple(sorted(set(ingredient_ids)))
+        slot = self._slots.get(recipe_id)
+        if slot is None:
+            slot = self._allocate()
+            self._slots[recipe_id] = slot
+            old_ingredients = ()
+        else:
+            old_ingredients = self._ingredients[recipe_id]
+
+        for ingredient_id in set(old_ingredients) - set(new_ingredients):
+            self._unlink(slot, ingredient_id)
+        for ingredient_id in set(new_ingredients) - set(old_ingredients):
+            self._link(slot, ingredient_id)
+
+        self._ingredients[recipe_id] = new_ingredients
+        self._ids[slot] = recipe_id
+        self._live[slot] = True
+        self._gluten_free[slot] = bool(gluten_free)
+        self._low_carb[slot] = bool(low_carb)
+        self._sizes[slot] = len(new_ingredients)
+        self._created[slot] = _timestamp(created_at)
+
+    def add_recipe(self, recipe: Recipe) -> None:
+        self.add(recipe.id, [i.id for i in recipe.ingredients], recipe.gluten_free, recipe.low_carb, recipe.created_at)
+
+    def remove(self, recipe_id: int) -> None:
+        slot = self._slots.pop(recipe_id, None)
+        if slot is None:
+            return
+        for ingredient_id in self._ingredients.pop(recipe_id):
+            self._unlink(slot, ingredient_id)
+        self._live[slot] = False
+        self._gluten_free[slot] = False
+        self._low_carb[slot] = False
+        self._sizes[slot] = 0
+        self._free.append(slot)
+
+    def _filter(self, mask: np.ndarray, excluded: Iterable[int], gluten_free: bool, low_carb: bool) -> np.ndarray:
+        for ingredient_id in set(excluded):
+            mask[self._posting(ingredient_id)] = False
+
+        mask &= self._live[:self._size]
+        if gluten_free:
+            mask &= self._gluten_free[:self._size]
+        if low_carb:
+            mask &= self._low_carb[:self._size]
+        return mask
+
+    def search(
+        self,
+        liked: Iterable[int],
+        excluded: Iterable[int] = (),
+        gluten_free: bool = False,
+        low_carb: bool = False
+    ) -> np.ndarray:
+        """Ids of recipes with any liked ingredient and no excluded one, in ascending order."""
+        mask = np.zeros(self._size, dtype=np.bool_)
+        for ingredient_id in set(liked):
+            mask[self._posting(ingredient_id)] = True
+        mask = self._filter(mask, excluded, gluten_free, low_carb)
+
+        return np.sort(self._ids[np.flatnonzero(mask)])
+
+    def rank(
+        self,
+        liked: Iterable[int],
+        excluded: Iterable[int] = (),
+        gluten_free: bool = False,
+        low_carb: bool = False,
+        limit: int | None = None,
+        fraction_weight: float = 1.0,
+        missing_penalty: float = 0.1,
+        recency_weight: float = 0.5,
+        recency_half_life_days: float = 30.0
+    ) -> Tuple[np.ndarray, int]:
+        """
+        Same candidates as `search`, ordered by score (best first).
+
+        score = liked + fraction_weight * liked / size - missing_penalty * (size - liked)
+                + recency_weight * 0.5 ** (age_days / recency_half_life_days)
+
+        Returns the ids of the top `limit` recipes (all when None) and the candidate count.
+        """
+        postings = [self._posting(ingredient_id) for ingredient_id in set(liked)]
+        if not postings:
+            return np.empty(0, dtype=np.int64), 0
+
+        # Liked ingredient count per recipe: row sums of the liked columns
+        liked_count = np.bincount(np.concatenate(postings), minlength=self._size)[:self._size]
+        mask = self._filter(liked_count > 0, excluded, gluten_free, low_carb)
+        slots = np.flatnonzero(mask)
+        if not len(slots):
+            return np.empty(0, dtype=np.int64), 0
+
+        matched = liked_count[slots].astype(np.float64)
+        sizes = np.maximum(self._sizes[slots], 1)
+        age_days = np.maximum(datetime.now(timezone.utc).timestamp() - self._created[slots], 0) / 86400
+        score = (
+            matched
+            + fraction_weight * matched / sizes
+            - missing_penalty * (sizes - matched)
+            + recency_weight * np.power(0.5, age_days / recency_half_life_days)
+        )
+
+        # Partial selection of the top k, then sort just those. Every score tied with the k-th
+        # is kept so that the lowest ids win the ties, as in a full sort
+        total = len(slots)
+        if limit is not None and limit < total:
+            kth = score[np.argpartition(-score, limit - 1)[limit - 1]]
+            top = np.flatnonzero(score >= kth)
+        else:
+            top = np.arange(total)
+        ids = self._ids[slots[top]]
+        order = np.lexsort((ids, -score[top]))[:limit]
+        return ids[order], total
+
+    def coverage(
+        self,
+        pantry: Iterable[int],
+        max_missing: int = 0,
+        gluten_free: bool = False,
+        low_carb: bool = False,
+        limit: int | None = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+        """
+        Recipes missing at most `max_missing` ingredients from `pantry`, best covered first.
+
+        Only recipes sharing at least one pantry ingredient are looked at. Returns the ids,
+        matched and missing counts of the top `limit` recipes and the total number of matches.
+        """
+        postings = [self._posting(ingredient_id) for ingredient_id in set(pantry)]
+        if not postings:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty, 0
+
+        # Pantry ingredients per touched recipe, compared with its precomputed ingredient count
+        slots, matched = np.unique(np.concatenate(postings), return_counts=True)
+        missing = self._sizes[slots] - matched
+        keep = self._live[slots] & (missing <= max_missing)
+        if gluten_free:
+            keep &= self._gluten_free[slots]
+        if low_carb:
+            keep &= self._low_carb[slots]
+        slots, matched, missing = slots[keep], matched[keep], missing[keep]
+
+        # Highest coverage first, then fewest missing, then recipe id
+        ids = self._ids[slots]
+        coverage = matched / np.maximum(self._sizes[slots], 1)
+        order = np.lexsort((ids, missing, -coverage))
+        if limit is not None:
+            order = order[:limit]
+        return ids[order], matched[order], missing[order], len(slots)
+
+    def clear(self) -> None:
+        self.__init__()
+
+    async def build(self, db: AsyncSession) -> None:
+        """(Re)build the whole index from the database."""
+        recipes = (await db.execute(
+            select(Recipe.id, Recipe.gluten_free, Recipe.low_carb, Recipe.created_at).order_by(Recipe.id)
+        )).all()
+        links = (await db.execute(
+            select(recipe_ingredient_association.c.recipe_id, recipe_ingredient_association.c.ingredient_id)
+        )).all()
+
+        self.clear()
+        count = len(recipes)
+        self._grow(max(1024, count))
+        self._size = count
+        if count:
+            ids, gluten_free, low_carb, created_at = zip(*recipes)
+            self._ids[:count] = ids
+            self._live[:count] = True
+            self._gluten_free[:count] = np.array(gluten_free, dtype=np.bool_)
+            self._low_carb[:count] = np.array(low_carb, dtype=np.bool_)
+            self._created[:count] = [_timestamp(value) for value in created_at]
+            self._slots = {recipe_id: slot for slot, recipe_id in enumerate(ids)}
+
+        ingredients_of: Dict[int, list[int]] = defaultdict(list)
+        link_array = np.array(links, dtype=np.int64).reshape(-1, 2)
+        if count and len(link_array):
+            # Slots follow recipe id order, so they can be found with a binary search
+            slots = np.searchsorted(self._ids[:count], link_array[:, 0]).clip(0, count - 1)
+            known = self._ids[slots] == link_array[:, 0]
+            slots, link_array = slots[known].astype(np.int32), link_array[known]
+
+            order = np.lexsort((slots, link_array[:, 1]))
+            slots, ingredient_ids = slots[order], link_array[order, 1]
+            keys, starts = np.unique(ingredient_ids, return_index=True)
+            for ingredient_id, chunk in zip(keys.tolist(), np.split(slots, starts[1:])):
+                self._postings[ingredient_id] = np.unique(chunk)
+            for recipe_id, ingredient_id in link_array.tolist():
+                ingredients_of[recipe_id].append(ingredient_id)
+
+        self._ingredients = {
+            recipe_id: tuple(sorted(set(ingredients_of.get(recipe_id, ())))) for recipe_id in self._slots
+        }
+        for recipe_id, slot in self._slots.items():
+            self._sizes[slot] = len(self._ingredients[recipe_id])
+        self.ready = True
+
+recipe_index = RecipeIndex()
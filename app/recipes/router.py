@@ -1,38 +1,100 @@
-import os
-import uuid
+from datetime import datetime
+from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile
+import redis.asyncio as redis
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, UploadFile, Query
+from fastapi_pagination.api import resolve_params
 from fastapi_pagination.links import Page
 from fastapi_pagination.ext.async_sqlalchemy import paginate
-from sqlalchemy import select
-from sqlalchemy.orm import joinedload
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import case, func, select, insert, or_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.models import Recipe, User, Ingredient
-from app.schemas import RecipeCreate, RecipeRead, RecipeImage, RecipeUpdate
-from app.database import get_db
+from app.models import Recipe, User, UserPreference, Ingredient, recipe_ingredient_association
+from app.schemas import RecipeCreate, RecipeRead, RecipeImage, RecipeUpdate, RecipePantryMatch, RecipeBulkResult
+from app.database import get_db, get_read_db, get_redis
+from app.cache import ResponseCache, get_response_cache, invalidate_tags, recipe_tag, ingredient_tag, RECIPES_TAG
 from app.config import settings
+from app.pagination import CursorPage, keyset_paginate, paginate_ids
 from app.auth.dependencies import get_current_user
-from app.recipes.utils import get_file_extension, delete_image_from_directory
-from app.recipes.dependencies import get_recipe_by_id
+from app.recipes.utils import (
+    save_image_upload, release_image, index_recipe, unindex_recipe, insert_recipes, add_ingredient_rows, pantry_match,
+    RECIPE_COLUMNS
+)
+from app.serialization import dumps, page_content
+from app.recipes.dependencies import get_recipe_by_id, sync_indexes
+from app.recipes.constants import BULK_CREATE_MAX_ITEMS, BULK_CREATE_CHUNK_SIZE
+from app.recipes.index import recipe_index
+from app.recipes.images import create_image_variants, existing_variants, image_relpath
+from app.recipes.search import text_index
+from app.recipes.sync import index_sync
 
 router = APIRouter(prefix='/recipes', tags=['recipes'], responses={404: {'description': 'Not found'}})
 
-@router.get('/search-by-preferences', status_code=200, response_model=Page[RecipeRead])
+@router.get('/search', status_code=200, response_model=Page[RecipeRead], dependencies=[Depends(sync_indexes)])
+async def search_recipes(
+    q: str = Query(..., min_length=1, description='Words to look for in title, instructions and ingredients'),
+    gluten_free: bool = False,
+    low_carb: bool = False,
+    db: AsyncSession = Depends(get_read_db)
+):
+    query = select(Recipe).options(selectinload(Recipe.ingredients))
+
+    # BM25 ranking from the text index, only the current page is read from the database
+    if settings.SEARCH_INDEX_ENABLED and text_index.ready:
+        raw_params = resolve_params().to_raw_params().as_limit_offset()
+        recipe_ids, total = text_index.search(q, gluten_free, low_carb, limit=raw_params.offset + raw_params.limit)
+        return await paginate_ids(db, query, Recipe.id, recipe_ids, total)
+
+    # Fallback without index: substring match, wildcards in q are taken literally
+    pattern = '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    query = query.where(or_(
+        Recipe.title.ilike(pattern, escape='\\'),
+        Recipe.instructions.ilike(pattern, escape='\\'),
+        Recipe.ingredients.any(Ingredient.name.ilike(pattern, escape='\\'))
+    ))
+    if gluten_free:
+        query = query.where(Recipe.gluten_free == True)
+    if low_carb:
+        query = query.where(Recipe.low_carb == True)
+
+    return await paginate(db, query.order_by(Recipe.id))
+
+@router.get('/search-by-preferences', status_code=200, response_model=Page[RecipeRead], dependencies=[Depends(sync_indexes)])
 async def search_by_preferences(
     gluten_free: bool = False, 
     low_carb: bool = False, 
+    ranked: bool = Query(False, description='Order by liked ingredients, missing ingredients and recency'),
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
-    await db.refresh(current_user, attribute_names=['preferences'])
+    result = await db.execute(select(UserPreference).where(UserPreference.user_id == current_user.id))
+    preferences = result.scalars().all()
 
     # Building query based in preferences
-    liked_ingredients = [p.ingredient_id for p in current_user.preferences if p.preference_type == 'like']
-    disliked_ingredients = [p.ingredient_id for p in current_user.preferences if p.preference_type in ['dislike', 'allergy']]
+    liked_ingredients = [p.ingredient_id for p in preferences if p.preference_type == 'like']
+    disliked_ingredients = [p.ingredient_id for p in preferences if p.preference_type in ['dislike', 'allergy']]
+
+    # Resolve candidates from the in-memory index, only the current page is read from the database
+    if settings.RECIPE_INDEX_ENABLED and recipe_index.ready:
+        query = select(Recipe).options(selectinload(Recipe.ingredients))
+        if ranked:
+            # Only the top offset + limit recipes need to be ordered
+            raw_params = resolve_params().to_raw_params().as_limit_offset()
+            recipe_ids, total = recipe_index.rank(
+                liked_ingredients, disliked_ingredients, gluten_free, low_carb,
+                limit=raw_params.offset + raw_params.limit
+            )
+            return await paginate_ids(db, query, Recipe.id, recipe_ids, total)
+
+        recipe_ids = recipe_index.search(liked_ingredients, disliked_ingredients, gluten_free, low_carb)
+        return await paginate_ids(db, query, Recipe.id, recipe_ids)
 
     # # Get liked ingredients
-    query = select(Recipe).where(
+    query = select(Recipe).options(selectinload(Recipe.ingredients)).where(
         Recipe.ingredients.any(Ingredient.id.in_(liked_ingredients))
     )
 
@@ -47,13 +109,74 @@ async def search_by_preferences(
     if low_carb:
         query = query.where(Recipe.low_carb == True)
 
+    if ranked:
+        # Score of RecipeIndex.rank without its recency term, newer recipes first on ties
+        link = recipe_ingredient_association.c
+        liked = func.sum(case((link.ingredient_id.in_(liked_ingredients), 1), else_=0))
+        size = func.count()
+        scores = (
+            select(link.recipe_id, (liked + 1.0 * liked / size - 0.1 * (size - liked)).label('score'))
+            .group_by(link.recipe_id)
+            .subquery()
+        )
+        query = query.join(scores, scores.c.recipe_id == Recipe.id).order_by(
+            scores.c.score.desc(), Recipe.created_at.desc(), Recipe.id
+        )
+
     data = await paginate(db, query)
     return data
 
+@router.get('/pantry', status_code=200, response_model=Page[RecipePantryMatch], dependencies=[Depends(sync_indexes)])
+async def search_by_pantry(
+    ingredients: List[int] = Query(..., description='Ingredient IDs available'),
+    max_missing: int = Query(0, ge=0, description='Missing ingredients allowed per recipe'),
+    gluten_free: bool = False,
+    low_carb: bool = False,
+    db: AsyncSession = Depends(get_read_db)
+):
+    raw_params = resolve_params().to_raw_params().as_limit_offset()
+    limit = raw_params.offset + raw_params.limit
+    if settings.RECIPE_INDEX_ENABLED and recipe_index.ready:
+        recipe_ids, matched, missing, total = recipe_index.coverage(
+            ingredients, max_missing, gluten_free, low_carb, limit=limit
+        )
+    else:
+        # Fallback without index: pantry ingredients counted per recipe in SQL, same order as the index
+        link = recipe_ingredient_association.c
+        matched = func.sum(case((link.ingredient_id.in_(ingredients), 1), else_=0))
+        missing = func.count() - matched
+        coverage_query = (
+            select(link.recipe_id, matched.label('matched'), missing.label('missing'))
+            .join(Recipe, Recipe.id == link.recipe_id)
+            .group_by(link.recipe_id)
+            .having(matched > 0, missing <= max_missing)
+        )
+        if gluten_free:
+            coverage_query = coverage_query.where(Recipe.gluten_free == True)
+        if low_carb:
+            coverage_query = coverage_query.where(Recipe.low_carb == True)
+
+        total = await db.scalar(select(func.count()).select_from(coverage_query.subquery()))
+        result = await db.execute(
+            coverage_query.order_by((1.0 * matched / func.count()).desc(), missing, link.recipe_id).limit(limit)
+        )
+        rows = result.all()
+        recipe_ids = [row.recipe_id for row in rows]
+        matched = [row.matched for row in rows]
+        missing = [row.missing for row in rows]
+    counts = {int(i): (int(m), int(x)) for i, m, x in zip(recipe_ids, matched, missing)}
+
+    def to_matches(recipes: List[Recipe]) -> List[RecipePantryMatch]:
+        return [pantry_match(recipe, *counts[recipe.id]) for recipe in recipes]
+
+    query = select(Recipe).options(selectinload(Recipe.ingredients))
+    return await paginate_ids(db, query, Recipe.id, recipe_ids, total, to_matches)
+
 @router.post('/', status_code=201, response_model=RecipeRead)
 async def create_recipe(
     recipe: RecipeCreate,
     db: AsyncSession = Depends(get_db),
+    r: redis.Redis = Depends(get_redis),
     current_user: User = Depends(get_current_user)
 ):
     # Verify if ingredients exist
@@ -77,79 +200,197 @@ async def create_recipe(
 
     result = await db.execute(select(Recipe).options(joinedload(Recipe.ingredients)).filter_by(id=new_recipe.id))
     new_recipe = result.scalar()
+    index_recipe(new_recipe)
+    await index_sync.publish(r, recipes=[new_recipe.id])
+    await invalidate_tags(r, RECIPES_TAG)
 
     return new_recipe 
 
+@router.post('/bulk', status_code=200, response_model=RecipeBulkResult)
+async def create_recipes_bulk(
+    recipes: List[RecipeCreate],
+    db: AsyncSession = Depends(get_db),
+    r: redis.Redis = Depends(get_redis),
+    current_user: User = Depends(get_current_user)
+):
+    if len(recipes) > BULK_CREATE_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f'At most {BULK_CREATE_MAX_ITEMS} recipes per request')
+    author_id = current_user.id
+
+    # Verify every referenced ingredient with a single query
+    ingredient_ids = {i for recipe in recipes for i in recipe.ingredients}
+    result = await db.execute(select(Ingredient).filter(Ingredient.id.in_(ingredient_ids)))
+    ingredients = {ingredient.id: ingredient for ingredient in result.scalars().all()}
+    for ingredient in ingredients.values():
+        # Keep them loaded if a chunk is rolled back
+        db.expunge(ingredient)
+
+    created, errors, valid = [], [], []
+    for index, recipe in enumerate(recipes):
+        invalid_ids = sorted({i for i in recipe.ingredients if i not in ingredients})
+        if invalid_ids:
+            errors.append({'index': index, 'detail': f'Invalid ingredient IDs: {invalid_ids}'})
+        else:
+            valid.append((index, recipe))
+
+    # Insert recipes and association rows in chunked transactions, one INSERT per table and chunk
+    for start in range(0, len(valid), BULK_CREATE_CHUNK_SIZE):
+        chunk = valid[start:start + BULK_CREATE_CHUNK_SIZE]
+        now = datetime.utcnow()
+        rows = [
+            {**recipe.model_dump(exclude={'ingredients'}), 'author_id': author_id, 'created_at': now, 'updated_at': now}
+            for _, recipe in chunk
+        ]
+
+        try:
+            recipe_ids = await insert_recipes(db, rows)
+            links = [
+                {'recipe_id': recipe_id, 'ingredient_id': ingredient_id}
+                for recipe_id, (_, recipe) in zip(recipe_ids, chunk)
+                for ingredient_id in dict.fromkeys(recipe.ingredients)
+            ]
+            if links:
+                await db.execute(insert(recipe_ingredient_association), links)
+            await db.commit()
+        except SQLAlchemyError:
+            await db.rollback()
+            errors.extend({'index': index, 'detail': 'Could not save recipe'} for index, _ in chunk)
+            continue
+
+        # Detached copies for the indexes, nothing is read back
+        for recipe_id, row, (_, recipe) in zip(recipe_ids, rows, chunk):
+            new_recipe = Recipe(id=recipe_id, **row)
+            set_committed_value(new_recipe, 'ingredients', [ingredients[i] for i in dict.fromkeys(recipe.ingredients)])
+            index_recipe(new_recipe)
+            created.append(recipe_id)
+
+    if created:
+        await index_sync.publish(r, recipes=created)
+        await invalidate_tags(r, RECIPES_TAG)
+
+    errors.sort(key=lambda error: error['index'])
+    return {'created': created, 'errors': errors}
+
 @router.get('/{id}/image', status_code=200, response_model=RecipeImage)
 async def get_recipe_image(recipe: Recipe = Depends(get_recipe_by_id)):
-    image_directory = os.path.join('app', 'static', 'images')
-    saved_file_extension = get_file_extension(image_directory, recipe.image_name)
-    image_url = f'{settings.BASE_URL}static/images/{recipe.image_name}.{saved_file_extension}'
-    return {'id': recipe.id, 'image_url': image_url}
+    if not recipe.image_name or not recipe.image_extension:
+        return {'id': recipe.id, 'image_url': None}
+
+    image_url = f'{settings.BASE_URL}static/images/{image_relpath(recipe.image_name, recipe.image_extension)}'
+    # Only the variants already generated, stat'ed off the event loop
+    variants = {}
+    if settings.IMAGE_VARIANTS_ENABLED:
+        existing = await run_in_threadpool(existing_variants, settings.IMAGE_DIRECTORY, recipe.image_name)
+        variants = {variant: f'{settings.BASE_URL}static/images/{relpath}' for variant, relpath in existing.items()}
+    return {'id': recipe.id, 'image_url': image_url, 'variants': variants}
 
 @router.patch('/{id}/image', status_code=201, response_model=RecipeRead, description='Upload/Update image')
 async def update_image(
     image_file: UploadFile,
+    background_tasks: BackgroundTasks,
     recipe: Recipe = Depends(get_recipe_by_id),
     db: AsyncSession = Depends(get_db),
+    r: redis.Redis = Depends(get_redis),
     current_user: User = Depends(get_current_user)
 ):
     # Check if current_user is owner
     if not recipe.author_id == current_user.id:
         raise HTTPException(403, 'Not authorized to modify this recipe')
 
-    # Check if file imagen is none, if image exist delete to the database
-    image_directory = os.path.join('app', 'static', 'images')
-    if recipe.image_name:
-        delete_image_from_directory(image_directory, recipe.image_name)
-
-    # Read img file
-    content = await image_file.read()
-    file_extension = image_file.filename.split('.')[-1] 
+    # Images are stored under their content hash, so identical uploads share one file
+    old_image_hash, old_image_extension = recipe.image_hash, recipe.image_extension
+    async with save_image_upload(image_file, settings.IMAGE_DIRECTORY, r) as (file_extension, file_size, file_hash):
+        recipe.image_name = file_hash
+        recipe.image_extension = file_extension
+        recipe.image_size = file_size
+        recipe.image_hash = file_hash
+        await db.commit()
+    await invalidate_tags(r, RECIPES_TAG, recipe_tag(recipe.id))
 
-    # Generate a unique filename using UUID
-    unique_filename = uuid.uuid4()
+    if old_image_hash and old_image_extension and old_image_hash != file_hash:
+        await release_image(db, r, old_image_hash, old_image_extension)
 
-    # Save img file
-    image_path = os.path.join('app', 'static', 'images', f'{unique_filename}.{file_extension}')
-    with open(image_path, 'wb') as buffer:
-        buffer.write(content)
-
-    recipe.image_name = str(unique_filename)
-    await db.commit()
+    # Resized WebP variants are generated after the response is sent
+    background_tasks.add_task(create_image_variants, settings.IMAGE_DIRECTORY, file_hash, file_extension)
 
     await db.refresh(recipe, attribute_names=['ingredients'])
 
     return recipe
 
+@router.get('/cursor', status_code=200, response_model=CursorPage[RecipeRead])
+async def get_recipes_by_cursor(
+    cursor: str | None = None,
+    size: int = Query(50, ge=1, le=100),
+    db: AsyncSession = Depends(get_read_db)
+):
+    query = select(Recipe).options(selectinload(Recipe.ingredients))
+    return await keyset_paginate(db, query, [Recipe.created_at, Recipe.id], cursor, size)
+
 @router.get('/', status_code=200, response_model=Page[RecipeRead])
-async def get_recipes(db: AsyncSession = Depends(get_db)):
-    data = await paginate(db, select(Recipe).options(joinedload(Recipe.ingredients)).order_by(Recipe.created_at))
-    return data
+async def get_recipes(cache: ResponseCache = Depends(get_response_cache), db: AsyncSession = Depends(get_read_db)):
+    if (response := await cache.get()) is not None:
+        return response
+
+    # Opt-in: plain rows to orjson, no ORM objects nor Pydantic validation
+    if settings.FAST_SERIALIZATION_ENABLED:
+        params = resolve_params()
+        raw_params = params.to_raw_params().as_limit_offset()
+        total = await db.scalar(select(func.count(Recipe.id)))
+        result = await db.execute(
+            select(*RECIPE_COLUMNS).order_by(Recipe.created_at, Recipe.id).limit(raw_params.limit).offset(raw_params.offset)
+        )
+        items = await add_ingredient_rows(db, [dict(row) for row in result.mappings()])
+        return await cache.set(dumps(page_content(items, total, params)), [RECIPES_TAG])
+
+    # selectinload: a joined eager load would materialize the whole recipe_ingredient table under LIMIT
+    data = await paginate(db, select(Recipe).options(selectinload(Recipe.ingredients)).order_by(Recipe.created_at, Recipe.id))
+    return await cache.set(data, [RECIPES_TAG])
 
 
 @router.get('/{id}', status_code=200, response_model=RecipeRead)
-async def get_recipe(recipe: Recipe = Depends(get_recipe_by_id)):
-    return recipe
+async def get_recipe(id: int, cache: ResponseCache = Depends(get_response_cache), db: AsyncSession = Depends(get_read_db)):
+    # Cache hits never reach the database
+    if (response := await cache.get()) is not None:
+        return response
+
+    recipe = await get_recipe_by_id(id, db)
+    tags = [recipe_tag(recipe.id), *(ingredient_tag(ingredient.id) for ingredient in recipe.ingredients)]
+    return await cache.set(RecipeRead.model_validate(recipe, from_attributes=True), tags)
 
 @router.put('/{id}', status_code=200, response_model=RecipeRead)
 async def update_recipe(
     recipe_data: RecipeUpdate,
     recipe: Recipe = Depends(get_recipe_by_id),
     db: AsyncSession = Depends(get_db),
+    r: redis.Redis = Depends(get_redis),
     current_user: User = Depends(get_current_user)
 ):
     # Check owner
     if not recipe.author_id == current_user.id:
         raise HTTPException(403, 'Not authorized to modify this recipe')
 
-    for field, value in recipe_data.model_dump().items():
+    recipe_dict = recipe_data.model_dump()
+
+    # Replace ingredients if they are given
+    ingredient_ids = recipe_dict.pop('ingredients', None)
+    if ingredient_ids is not None:
+        result = await db.execute(select(Ingredient).filter(Ingredient.id.in_(ingredient_ids)))
+        ingredients = result.scalars().all()
+
+        if len(ingredients) != len(ingredient_ids):
+            raise HTTPException(status_code=400, detail='Some ingredient IDs are invalid')
+        recipe.ingredients = ingredients
+
+    for field, value in recipe_dict.items():
         if value is not None:
             setattr(recipe, field, value)
 
     await db.commit()
 
     await db.refresh(recipe, attribute_names=['ingredients'])
+    index_recipe(recipe)
+    await index_sync.publish(r, recipes=[recipe.id])
+    await invalidate_tags(r, RECIPES_TAG, recipe_tag(recipe.id))
 
     return recipe
 
@@ -158,13 +399,21 @@ async def update_recipe(
 async def delete_recipe(
     recipe: Recipe = Depends(get_recipe_by_id),
     db: AsyncSession = Depends(get_db),
+    r: redis.Redis = Depends(get_redis),
     current_user: User = Depends(get_current_user)
 ):
     # Check owner
     if not recipe.author_id == current_user.id:
         raise HTTPException(403, 'Not authorized to delete this recipe')
 
+    image_hash, image_extension = recipe.image_hash, recipe.image_extension
     await db.delete(recipe)
     await db.commit()
+    unindex_recipe(recipe.id)
+    await index_sync.publish(r, recipes=[recipe.id])
+    await invalidate_tags(r, RECIPES_TAG, recipe_tag(recipe.id))
+
+    if image_hash and image_extension:
+        await release_image(db, r, image_hash, image_extension)
 
     return
\ No newline at end of file
@@ -0,0 +1,261 @@
+# Full-text recipe search (BM25)
+import heapq
+import math
+import os
+import pickle
+import re
+import tempfile
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Recipe, Ingredient, recipe_ingredient_association
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Bump when the on-disk format or the tokenizer changes
+INDEX_VERSION = 1
+
+# Title words count more than instructions or ingredient names
+TITLE_WEIGHT = 2
+
+def tokenize(text: str | None) -> List[str]:
+    if not text:
+        return []
+    # Lowercase and strip accents, so "limón" matches "limon"
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return TOKEN_RE.findall(text)
+
+class TextIndex:
+    """
+    Tokenized inverted index over recipe title, instructions and ingredient names, ranked with BM25.
+
+    Ingredient names are indexed once per ingredient and folded into every recipe that uses it,
+    so renaming an ingredient only re-indexes the recipes that contain it.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ready = False
+        self.dirty = False
+        self._postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self._doc_terms: Dict[int, Counter] = {}
+        self._doc_length: Dict[int, int] = {}
+        self._doc_text: Dict[int, Counter] = {}
+        self._doc_ingredients: Dict[int, Tuple[int, ...]] = {}
+        self._doc_flags: Dict[int, Tuple[bool, bool]] = {}
+        self._ingredient_terms: Dict[int, Counter] = {}
+        self._ingredient_docs: Dict[int, Set[int]] = defaultdict(set)
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def _unindex(self, recipe_id: int) -> None:
+        terms = self._doc_terms.pop(recipe_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            posting = self._postings[term]
+            posting.pop(recipe_id, None)
+            if not posting:
+                del self._postings[term]
+        self._total_length -= self._doc_length.pop(recipe_id)
+
+    def _index(self, recipe_id: int) -> None:
+        terms = Counter(self._doc_text[recipe_id])
+        for ingredient_id in self._doc_ingredients[recipe_id]:
+            terms.update(self._ingredient_terms.get(ingredient_id, ()))
+        for term, tf in terms.items():
+            self._postings[term][recipe_id] = tf
+        self._doc_terms[recipe_id] = terms
+        self._doc_length[recipe_id] = sum(terms.values())
+        self._total_length += self._doc_length[recipe_id]
+
+    def set_ingredient(self, ingredient_id: int, name: str | None) -> None:
+        """Add or rename an ingredient and re-index the recipes that use it."""
+        self._ingredient_terms[ingredient_id] = Counter(tokenize(name))
+        for recipe_id in self._ingredient_docs.get(ingredient_id, ()):
+            self._unindex(recipe_id)
+            self._index(recipe_id)
+        self.dirty = True
+
+    def remove_ingredient(self, ingredient_id: int) -> None:
+        """Drop a deleted ingredient and re-index the recipes that used it without its name."""
+        self._ingredient_terms.pop(ingredient_id, None)
+        for recipe_id in self._ingredient_docs.pop(ingredient_id, ()):
+            self._doc_ingredients[recipe_id] = tuple(i for i in self._doc_ingredients[recipe_id] if i != ingredient_id)
+            self._unindex(recipe_id)
+            self._index(recipe_id)
+        self.dirty = True
+
+    def add(
+        self,
+        recipe_id: int,
+        title: str,
+        instructions: str,
+        ingredient_ids: Iterable[int],
+        gluten_free: bool = False,
+        low_carb: bool = False
+    ) -> None:
+        """Insert a recipe, or replace it if it is already indexed."""
+        self.remove(recipe_id)
+
+        text = Counter(tokenize(instructions))
+        for term in tokenize(title):
+            text[term] += TITLE_WEIGHT
+        ingredients = tuple(sorted(set(ingredient_ids)))
+
+        self._doc_text[recipe_id] = text
+        self._doc_ingredients[recipe_id] = ingredients
+        self._doc_flags[recipe_id] = (bool(gluten_free), bool(low_carb))
+        for ingredient_id in ingredients:
+            self._ingredient_docs[ingredient_id].add(recipe_id)
+        self._index(recipe_id)
+        self.dirty = True
+
+    def add_recipe(self, recipe: Recipe) -> None:
+        for ingredient in recipe.ingredients:
+            if ingredient.id not in self._ingredient_terms:
+                self._ingredient_terms[ingredient.id] = Counter(tokenize(ingredient.name))
+        self.add(
+            recipe.id, recipe.title, recipe.instructions,
+            [i.id for i in recipe.ingredients], recipe.gluten_free, recipe.low_carb
+        )
+
+    def remove(self, recipe_id: int) -> None:
+        if recipe_id not in self._doc_text:
+            return
+        self._unindex(recipe_id)
+        for ingredient_id in self._doc_ingredients.pop(recipe_id):
+            self._ingredient_docs[ingredient_id].discard(recipe_id)
+        del self._doc_text[recipe_id]
+        del self._doc_flags[recipe_id]
+        self.dirty = True
+
+    def search(
+        self,
+        query: str,
+        gluten_free: bool = False,
+        low_carb: bool = False,
+        limit: int | None = None
+    ) -> Tuple[List[int], int]:
+        """Return the ids of the best `limit` matches (all when None) and the number of matches."""
+        count = len(self._doc_terms)
+        if not count:
+            return [], 0
+        avg_length = self._total_length / count
+
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            posting = self._postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+            for recipe_id, tf in posting.items():
+                norm = self.k1 * (1 - self.b + self.b * self._doc_length[recipe_id] / avg_length)
+                scores[recipe_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        if gluten_free or low_carb:
+            scores = {
+                recipe_id: score for recipe_id, score in scores.items()
+                if (not gluten_free or self._doc_flags[recipe_id][0])
+                and (not low_carb or self._doc_flags[recipe_id][1])
+            }
+
+        def key(item):
+            return (item[1], -item[0])
+
+        if limit is None:
+            ranked = sorted(scores.items(), key=key, reverse=True)
+        else:
+            ranked = heapq.nlargest(limit, scores.items(), key=key)
+        return [recipe_id for recipe_id, _ in ranked], len(scores)
+
+    async def build(self, db: AsyncSession) -> None:
+        """(Re)build the whole index from the database."""
+        ingredients = (await db.execute(select(Ingredient.id, Ingredient.name))).all()
+        recipes = (await db.execute(
+            select(Recipe.id, Recipe.title, Recipe.instructions, Recipe.gluten_free, Recipe.low_carb)
+        )).all()
+        links = (await db.execute(
+            select(recipe_ingredient_association.c.recipe_id, recipe_ingredient_association.c.ingredient_id)
+        )).all()
+
+        self.__init__(self.k1, self.b)
+        for ingredient_id, name in ingredients:
+            self._ingredient_terms[ingredient_id] = Counter(tokenize(name))
+
+        ingredients_of: Dict[int, List[int]] = defaultdict(list)
+        for recipe_id, ingredient_id in links:
+            ingredients_of[recipe_id].append(ingredient_id)
+        for recipe_id, title, instructions, gluten_free, low_carb in recipes:
+            self.add(recipe_id, title, instructions, ingredients_of.get(recipe_id, ()), gluten_free, low_carb)
+        self.ready = True
+
+    def _state(self) -> Dict[str, Any]:
+        return {
+            name: value for name, value in vars(self).items()
+            if name.startswith('_')
+        }
+
+    def save(self, path: str, fingerprint: Any = None) -> None:
+        # Write to a temp file and rename so a crash never leaves a truncated index,
+        # unique per call since every worker saves its own copy on shutdown
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.search-index-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(
+                    {'version': INDEX_VERSION, 'fingerprint': fingerprint, 'state': self._state()},
+                    f, protocol=pickle.HIGHEST_PROTOCOL
+                )
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.dirty = False
+
+    def load(self, path: str, fingerprint: Any = None) -> bool:
+        """Load a saved index; returns False if it is missing, outdated or does not match `fingerprint`."""
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return False
+        if data.get('version') != INDEX_VERSION or data.get('fingerprint') != fingerprint:
+            return False
+
+        self.__init__(self.k1, self.b)
+        vars(self).update(data['state'])
+        self.ready = True
+        self.dirty = False
+        return True
+
+async def get_fingerprint(db: AsyncSession, version: int = 0) -> List[Any]:
+    """
+    Cheap summary of the indexed tables used to tell whether a saved index is stale.
+
+    Ingredients have no update time, so renames are only seen through `version`, the
+    change counter that write endpoints bump (see app.recipes.sync).
+    """
+    link = recipe_ingredient_association.c
+    recipes = (await db.execute(
+        select(func.count(Recipe.id), func.max(Recipe.id), func.max(Recipe.updated_at))
+    )).one()
+    links = (await db.execute(
+        select(func.count(), func.max(link.recipe_id), func.sum(link.ingredient_id))
+    )).one()
+    ingredients = (await db.execute(select(func.count(Ingredient.id), func.max(Ingredient.id)))).one()
+
+    count, max_id, last_update = recipes
+    return [
+        version, count, max_id, last_update.isoformat() if last_update else None,
+        *links, *ingredients
+    ]
+
+text_index = TextIndex()
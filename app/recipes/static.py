@@ -0,0 +1,81 @@
+# Static serving for content-addressed recipe images
+import os
+import re
+from mimetypes import guess_type
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response, StreamingResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+from app.cache import etag_matches
+from app.recipes.constants import IMAGE_CHUNK_SIZE
+from app.recipes.images import IMAGE_VARIANTS
+
+HASH_RE = re.compile(r'[0-9a-f]{64}')
+RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)')
+
+# Content never changes under a given URL
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+def content_etag(full_path: str) -> str | None:
+    """Strong ETag from the content hash in the file name, None for files that are not content-addressed."""
+    stem = os.path.splitext(os.path.basename(full_path))[0]
+    if not HASH_RE.fullmatch(stem):
+        return None
+    variant = os.path.basename(os.path.dirname(os.path.dirname(full_path)))
+    return f'"{stem}-{variant}"' if variant in IMAGE_VARIANTS else f'"{stem}"'
+
+def range_response(full_path: str, size: int, range_header: str, headers: dict) -> Response | None:
+    """206 response for a single byte range, 416 if it cannot be satisfied, None to send the whole file."""
+    match = RANGE_RE.fullmatch(range_header.strip())
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+
+    first, last = match.groups()
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(size - int(last), 0), size - 1
+    if start >= size or start > end:
+        return Response(status_code=416, headers={**headers, 'content-range': f'bytes */{size}'})
+
+    async def content():
+        async with await anyio.open_file(full_path, 'rb') as f:
+            await f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await f.read(min(IMAGE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    return StreamingResponse(
+        content(),
+        status_code=206,
+        media_type=guess_type(full_path)[0],
+        headers={**headers, 'content-range': f'bytes {start}-{end}/{size}', 'content-length': str(end - start + 1)},
+    )
+
+class ImageStaticFiles(StaticFiles):
+    """StaticFiles with strong ETags, immutable caching and Range support for content-addressed images."""
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200) -> Response:
+        etag = content_etag(str(full_path))
+        if etag is None or status_code != 200:
+            return super().file_response(full_path, stat_result, scope, status_code)
+
+        request_headers = Headers(scope=scope)
+        headers = {'etag': etag, 'cache-control': IMMUTABLE_CACHE_CONTROL, 'accept-ranges': 'bytes'}
+        if etag_matches(request_headers.get('if-none-match'), etag):
+            return NotModifiedResponse(Headers(headers))
+
+        # If-Range with another validator asks for the whole file
+        range_header = request_headers.get('range')
+        if range_header and scope['method'] == 'GET' and request_headers.get('if-range', etag) == etag:
+            response = range_response(str(full_path), stat_result.st_size, range_header, headers)
+            if response is not None:
+                return response
+
+        return FileResponse(full_path, stat_result=stat_result, method=scope['method'], headers=headers)
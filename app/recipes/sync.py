@@ -0,0 +1,147 @@
+# Keeps the in-memory search indexes of every worker process in step through Redis
+import asyncio
+import logging
+import uuid
+from typing import Iterable, List, Set
+
+import redis.asyncio as redis
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+from app import database
+from app.models import Recipe, Ingredient
+from app.recipes.constants import INDEX_CHANGES_MAXLEN
+from app.recipes.index import recipe_index
+from app.recipes.search import text_index
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'recipe-index:version'
+CHANGES_KEY = 'recipe-index:changes'
+
+def _join(ids: Iterable[int]) -> str:
+    return ','.join(str(i) for i in ids)
+
+def _split(value: bytes | None) -> List[int]:
+    return [int(i) for i in value.decode('utf-8').split(',')] if value else []
+
+class IndexSync:
+    """
+    Change feed shared by the worker processes, each one holds its own copy of the indexes.
+
+    Writers bump a version counter and append the changed recipe and ingredient ids to a
+    capped stream in one transaction. Before a search the worker compares that counter with
+    the version its indexes reflect, and reloads the changed rows from the primary database.
+    A worker that fell behind the trimmed stream rebuilds its indexes instead.
+    """
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex
+        self.version = 0
+        self.last_id = '0-0'
+        self._lock = asyncio.Lock()
+
+    async def start(self, r: redis.Redis) -> None:
+        """Remember the current position, called right before the indexes are built."""
+        try:
+            async with r.pipeline(transaction=True) as pipe:
+                pipe.get(VERSION_KEY)
+                pipe.xrevrange(CHANGES_KEY, count=1)
+                version, last = await pipe.execute()
+        except redis.RedisError:
+            logger.warning('Recipe index changes unavailable, writes of other workers are not seen', exc_info=True)
+            return
+        self.version = int(version or 0)
+        self.last_id = last[0][0].decode('utf-8') if last else '0-0'
+
+    async def publish(self, r: redis.Redis, recipes: Iterable[int] = (), ingredients: Iterable[int] = ()) -> None:
+        """Tell the other workers which recipes and ingredients changed, after the commit."""
+        fields = {'origin': self.origin, 'recipes': _join(recipes), 'ingredients': _join(ingredients)}
+        try:
+            async with r.pipeline(transaction=True) as pipe:
+                pipe.incr(VERSION_KEY)
+                pipe.xadd(CHANGES_KEY, fields, maxlen=INDEX_CHANGES_MAXLEN, approximate=True)
+                version, entry_id = await pipe.execute()
+        except redis.RedisError:
+            logger.warning('Could not publish recipe index changes %s', fields, exc_info=True)
+            return
+
+        # Nobody else wrote since the last sync, this process is up to date
+        if version == self.version + 1:
+            self.version = version
+            self.last_id = entry_id.decode('utf-8')
+
+    async def sync(self, r: redis.Redis) -> None:
+        """Apply the changes made by other workers since the last call."""
+        if not (recipe_index.ready or text_index.ready):
+            return
+        try:
+            # Common case: nothing changed, one GET
+            if int(await r.get(VERSION_KEY) or 0) == self.version:
+                return
+            async with self._lock:
+                applied = self.version
+                async with r.pipeline(transaction=True) as pipe:
+                    pipe.get(VERSION_KEY)
+                    pipe.xread({CHANGES_KEY: self.last_id})
+                    pipe.xrevrange(CHANGES_KEY, count=1)
+                    version, streams, last = await pipe.execute()
+                version = int(version or 0)
+                if version == applied:
+                    return
+
+                entries = streams[0][1] if streams else []
+                if len(entries) != version - applied:
+                    # Trimmed past our position, or Redis lost the feed
+                    logger.info('Recipe index fell behind, rebuilding it')
+                    await self.rebuild()
+                else:
+                    recipes: Set[int] = set()
+                    ingredients: Set[int] = set()
+                    for _, fields in entries:
+                        if fields[b'origin'].decode('utf-8') != self.origin:
+                            recipes.update(_split(fields.get(b'recipes')))
+                            ingredients.update(_split(fields.get(b'ingredients')))
+                    await self.apply(recipes, ingredients)
+
+                # A publish may have moved ahead meanwhile
+                if version > self.version:
+                    self.version = version
+                    if last:
+                        self.last_id = last[0][0].decode('utf-8')
+        except redis.RedisError:
+            logger.warning('Recipe index changes unavailable, searching the local index', exc_info=True)
+
+    async def apply(self, recipes: Set[int], ingredients: Set[int]) -> None:
+        # Read from the primary, replicas may not have the change yet
+        async with database.AsyncSessionLocal() as db:
+            if ingredients:
+                result = await db.execute(select(Ingredient.id, Ingredient.name).where(Ingredient.id.in_(ingredients)))
+                names = dict(result.all())
+                for ingredient_id in ingredients:
+                    if ingredient_id in names:
+                        text_index.set_ingredient(ingredient_id, names[ingredient_id])
+                    else:
+                        text_index.remove_ingredient(ingredient_id)
+
+            if recipes:
+                result = await db.execute(
+                    select(Recipe).options(selectinload(Recipe.ingredients)).where(Recipe.id.in_(recipes))
+                )
+                found = {recipe.id: recipe for recipe in result.scalars()}
+                for recipe_id in recipes:
+                    if recipe_id in found:
+                        recipe_index.add_recipe(found[recipe_id])
+                        text_index.add_recipe(found[recipe_id])
+                    else:
+                        recipe_index.remove(recipe_id)
+                        text_index.remove(recipe_id)
+
+    async def rebuild(self) -> None:
+        async with database.AsyncSessionLocal() as db:
+            if recipe_index.ready:
+                await recipe_index.build(db)
+            if text_index.ready:
+                await text_index.build(db)
+
+index_sync = IndexSync()
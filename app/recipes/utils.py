@@ -1,13 +1,207 @@
+import hashlib
+import logging
 import os
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, BinaryIO, Dict, List, Tuple
 
-def delete_image_from_directory(directory: str, filename_without_extension: str) -> None:
-    for file in os.listdir(directory):
-        if file.startswith(filename_without_extension):
-            os.remove(os.path.join(directory, file))
-            break
-
-def get_file_extension(directory: str, filename_without_extension: str) -> str:
-    for file in os.listdir(directory):
-        if file.startswith(filename_without_extension):
-            return file.split('.')[-1]
-    return ''
\ No newline at end of file
+import redis.asyncio as redis
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.models import Recipe, Ingredient, recipe_ingredient_association
+from app.schemas import RecipeRead, RecipePantryMatch, IngredientRead
+from app.serialization import schema_columns
+from app.recipes.index import recipe_index
+from app.recipes.search import text_index, get_fingerprint
+from app.recipes.sync import index_sync
+from app.recipes.constants import IMAGE_CHUNK_SIZE, IMAGE_CONTENT_TYPES, IMAGE_LOCK_PREFIX, IMAGE_LOCK_TIMEOUT
+from app.recipes.images import image_relpath, delete_image_variants
+
+logger = logging.getLogger(__name__)
+
+def delete_image(directory: str, filename_without_extension: str, extension: str) -> None:
+    path = os.path.join(directory, image_relpath(filename_without_extension, extension))
+    if os.path.exists(path):
+        os.remove(path)
+
+# Image uploads
+def detect_image_extension(header: bytes) -> str | None:
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header.startswith((b'GIF87a', b'GIF89a')):
+        return 'gif'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+def _copy_image(source: BinaryIO, directory: str, max_size: int) -> Tuple[str, str, int, str]:
+    # Runs in a worker thread: chunked copy into a temp file, hashed on the way
+    tmp_path = os.path.join(directory, f'.{uuid.uuid4()}.tmp')
+    size = 0
+    extension = None
+    content_hash = hashlib.sha256()
+    try:
+        with open(tmp_path, 'wb') as buffer:
+            while chunk := source.read(IMAGE_CHUNK_SIZE):
+                if extension is None:
+                    extension = detect_image_extension(chunk)
+                    if extension is None:
+                        raise HTTPException(415, 'File is not a supported image')
+                size += len(chunk)
+                if size > max_size:
+                    raise HTTPException(413, f'Image exceeds {max_size} bytes')
+                content_hash.update(chunk)
+                buffer.write(chunk)
+        if extension is None:
+            raise HTTPException(400, 'Image file is empty')
+    except BaseException:
+        _discard(tmp_path)
+        raise
+    return tmp_path, extension, size, content_hash.hexdigest()
+
+def _store_image(tmp_path: str, directory: str, content_hash: str, extension: str) -> None:
+    # Same hash, same bytes: replacing an existing file is a harmless dedup
+    path = os.path.join(directory, image_relpath(content_hash, extension))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(tmp_path, path)
+
+def _discard(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
+
+@asynccontextmanager
+async def image_lock(r: redis.Redis, content_hash: str) -> AsyncIterator[None]:
+    """
+    Held while an image is stored and referenced, and while it is counted and deleted,
+    so a release never deletes a file that a concurrent upload of the same content relies on.
+    """
+    lock = r.lock(f'{IMAGE_LOCK_PREFIX}{content_hash}', timeout=IMAGE_LOCK_TIMEOUT, blocking_timeout=IMAGE_LOCK_TIMEOUT)
+    try:
+        acquired = await lock.acquire()
+    except redis.RedisError:
+        acquired = False
+    if not acquired:
+        logger.warning('Could not lock image %s, going on without the lock', content_hash)
+    try:
+        yield
+    finally:
+        if acquired:
+            try:
+                await lock.release()
+            except redis.RedisError:
+                logger.warning('Could not unlock image %s', content_hash, exc_info=True)
+
+@asynccontextmanager
+async def save_image_upload(
+    image_file: UploadFile, directory: str, r: redis.Redis
+) -> AsyncIterator[Tuple[str, int, str]]:
+    """
+    Stream an uploaded image to `directory` off the event loop, stored under its SHA-256.
+    Yields its extension, size and hash under the image lock, reference it before leaving.
+    """
+    if image_file.content_type not in IMAGE_CONTENT_TYPES:
+        raise HTTPException(415, 'File is not a supported image')
+    await image_file.seek(0)
+    tmp_path, extension, size, content_hash = await run_in_threadpool(
+        _copy_image, image_file.file, directory, settings.IMAGE_MAX_SIZE
+    )
+    try:
+        async with image_lock(r, content_hash):
+            await run_in_threadpool(_store_image, tmp_path, directory, content_hash, extension)
+            yield extension, size, content_hash
+    finally:
+        await run_in_threadpool(_discard, tmp_path)
+
+async def release_image(db: AsyncSession, r: redis.Redis, content_hash: str, extension: str) -> None:
+    """Delete a stored image and its variants once no recipe references it anymore."""
+    async with image_lock(r, content_hash):
+        result = await db.execute(select(func.count(Recipe.id)).where(Recipe.image_hash == content_hash))
+        if result.scalar():
+            return
+        await run_in_threadpool(delete_image, settings.IMAGE_DIRECTORY, content_hash, extension)
+        await run_in_threadpool(delete_image_variants, settings.IMAGE_DIRECTORY, content_hash)
+
+# Bulk creation
+# MySQL @@auto_increment_increment, read once per process
+_id_step: int | None = None
+
+async def insert_recipes(db: AsyncSession, rows: List[Dict[str, Any]]) -> List[int]:
+    """Insert `rows` with one multi-row INSERT and return their new ids, in the same order."""
+    global _id_step
+    table = Recipe.__table__
+    statement = insert(table).values(rows)
+    if db.get_bind().dialect.insert_returning:
+        # Ids are allocated in VALUES order
+        result = await db.execute(statement.returning(table.c.id))
+        return sorted(result.scalars())
+
+    # MySQL: LAST_INSERT_ID() is the id of the first row, a multi-row INSERT with a known
+    # row count gets one id every auto_increment_increment after it
+    if _id_step is None:
+        _id_step = int(await db.scalar(text('SELECT @@auto_increment_increment')))
+    result = await db.execute(statement)
+    return list(range(result.lastrowid, result.lastrowid + len(rows) * _id_step, _id_step))
+
+# Search indexes
+def index_recipe(recipe: Recipe) -> None:
+    recipe_index.add_recipe(recipe)
+    text_index.add_recipe(recipe)
+
+def unindex_recipe(recipe_id: int) -> None:
+    recipe_index.remove(recipe_id)
+    text_index.remove(recipe_id)
+
+async def build_indexes(db: AsyncSession, r: redis.Redis) -> None:
+    # Changes published from here on are applied on top of what is built
+    await index_sync.start(r)
+
+    if settings.RECIPE_INDEX_ENABLED:
+        await recipe_index.build(db)
+
+    # Text index is loaded from disk when it still matches the database
+    if settings.SEARCH_INDEX_ENABLED:
+        fingerprint = await get_fingerprint(db, index_sync.version)
+        if not text_index.load(settings.SEARCH_INDEX_PATH, fingerprint):
+            await text_index.build(db)
+            text_index.save(settings.SEARCH_INDEX_PATH, fingerprint)
+
+async def save_indexes(db: AsyncSession) -> None:
+    if settings.SEARCH_INDEX_ENABLED and text_index.ready and text_index.dirty:
+        text_index.save(settings.SEARCH_INDEX_PATH, await get_fingerprint(db, index_sync.version))
+
+def pantry_match(recipe: Recipe, matched: int, missing: int) -> RecipePantryMatch:
+    return RecipePantryMatch(
+        **RecipeRead.model_validate(recipe, from_attributes=True).model_dump(),
+        matched=matched,
+        missing=missing,
+        coverage=matched / max(matched + missing, 1)
+    )
+
+# Fast serialization
+RECIPE_COLUMNS = schema_columns(Recipe, RecipeRead)
+INGREDIENT_COLUMNS = schema_columns(Ingredient, IngredientRead)
+
+async def add_ingredient_rows(db: AsyncSession, recipes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Fill `ingredients` of recipe dicts with ingredient dicts, one query for all of them."""
+    ingredients = defaultdict(list)
+    if recipes:
+        link = recipe_ingredient_association.c
+        result = await db.execute(
+            select(link.recipe_id, *INGREDIENT_COLUMNS)
+            .join(Ingredient, Ingredient.id == link.ingredient_id)
+            .where(link.recipe_id.in_([recipe['id'] for recipe in recipes]))
+        )
+        names = [column.key for column in INGREDIENT_COLUMNS]
+        for row in result:
+            ingredients[row[0]].append(dict(zip(names, row[1:])))
+
+    for recipe in recipes:
+        recipe['ingredients'] = ingredients[recipe['id']]
+    return recipes
@@ -1,5 +1,5 @@
 # Global schemas
-from typing import List
+from typing import Dict, List
 from datetime import datetime
 
 from pydantic import BaseModel, EmailStr, HttpUrl
@@ -21,6 +21,13 @@ class IngredientUpdate(BaseModel):
     description: str | None = None
     author_id: int | None = None
 
+class IngredientLoadResult(BaseModel):
+    loaded: int
+    skipped: int
+    chunks: int
+    seconds: float
+    rows_per_second: float
+
 # Recipe Schemas
 class RecipeBase(BaseModel):
     title: str
@@ -40,6 +47,11 @@ class RecipeRead(RecipeBase):
     created_at: datetime | None
     updated_at: datetime | None
 
+class RecipePantryMatch(RecipeRead):
+    matched: int
+    missing: int
+    coverage: float
+
 class RecipeUpdate(BaseModel):
     title: str | None = None
     ingredients: List[int] | None = None
@@ -48,9 +60,18 @@ class RecipeUpdate(BaseModel):
     low_carb: bool | None = None
     gluten_free: bool | None = None 
 
+class RecipeBulkError(BaseModel):
+    index: int
+    detail: str
+
+class RecipeBulkResult(BaseModel):
+    created: List[int]
+    errors: List[RecipeBulkError]
+
 class RecipeImage(BaseModel):
     id: int
     image_url: HttpUrl | None = None
+    variants: Dict[str, HttpUrl] = {}
 
 # User Schemas
 class UserBase(BaseModel):
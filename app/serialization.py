@@ -0,0 +1,37 @@
+# Fast JSON path for list endpoints: rows projected straight to dicts and encoded with orjson
+from math import ceil
+from typing import Any, Dict, List, Type
+
+import orjson
+from fastapi_pagination.bases import AbstractParams
+from fastapi_pagination.links.bases import create_links
+from pydantic import BaseModel
+from sqlalchemy import Column
+
+from app.database import Base
+
+def schema_columns(model: Type[Base], schema: Type[BaseModel]) -> List[Column]:
+    """Table columns of `model` that `schema` exposes, in schema order."""
+    table = model.__table__
+    return [table.c[name] for name in schema.model_fields if name in table.c]
+
+def page_content(items: List[Dict[str, Any]], total: int, params: AbstractParams) -> Dict[str, Any]:
+    """Same document as fastapi_pagination.links.Page, without validating the items again."""
+    page, size = params.page, params.size
+    links = create_links(
+        first={'page': 1},
+        last={'page': ceil(total / size) if total > 0 else 1},
+        next={'page': page + 1} if page * size < total else None,
+        prev={'page': page - 1} if page - 1 >= 1 else None,
+    )
+    return {
+        'items': items,
+        'total': total,
+        'page': page,
+        'size': size,
+        'pages': ceil(total / size),
+        'links': links.model_dump(),
+    }
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content)
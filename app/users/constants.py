@@ -4,3 +4,7 @@ class PreferenceType(str, Enum):
     ALLERGY = 'allergy'
     LIKE = 'like'
     DISLIKE = 'dislike'
+
+# Bulk updates
+PREFERENCES_MAX_ITEMS = 1000
+SAVED_RECIPES_MAX_ITEMS = 1000
@@ -1,18 +1,19 @@
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi_pagination import paginate
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi_pagination.ext.async_sqlalchemy import paginate
 from fastapi_pagination.links import Page
 from sqlalchemy import select
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.schemas import UserRead, RecipeRead
-from app.models import User, UserPreference, Recipe
-from app.database import get_db
+from app.models import User, UserPreference, Recipe, user_saved_recipes
+from app.database import get_db, get_read_db
 from app.auth.dependencies import get_current_user
-from app.users.schemas import UserPreferenceRead, UserPreferenceCreate, SavedRecipe
-from app.users.dependencies import get_recipe_by_id
+from app.users.schemas import UserPreferenceRead, UserPreferenceCreate, SavedRecipe, SavedRecipeBatch
+from app.users.utils import upsert_preferences, save_recipes, unsave_recipes
+from app.users.constants import PREFERENCES_MAX_ITEMS, SAVED_RECIPES_MAX_ITEMS
 
 router = APIRouter(prefix='/users', tags=['users'], responses={404: {'description': 'Not found'}})
 
@@ -23,11 +24,10 @@ async def get_me(current_user: User = Depends(get_current_user)):
 @router.get('/me/preferences', status_code=200, response_model=List[UserPreferenceRead])
 async def get_preferences(
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
-    await db.refresh(current_user, attribute_names=['preferences'])
-    
-    return current_user.preferences
+    result = await db.execute(select(UserPreference).where(UserPreference.user_id == current_user.id))
+    return result.scalars().all()
 
 @router.post('/me/preferences', status_code=201)
 async def set_user_preference(
@@ -35,38 +35,36 @@ async def set_user_preference(
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    # Check if preferences exist
-    query = select(UserPreference).where(UserPreference.user_id == current_user.id)
-    result = await db.execute(query)
-    existing_preferences = result.scalars().all()
-
-    for existing_preference in existing_preferences:
-        if existing_preference.ingredient_id == preference.ingredient_id:
-            # If preference exist, update
-            existing_preference.preference_type = preference.preference_type
-            break
-    else:
-        # Create new preference
-        new_preference = UserPreference(
-            user_id = current_user.id,
-            **preference.model_dump()
-        )
-        db.add(new_preference)
-
-    await db.commit()
+    await upsert_preferences(db, current_user.id, [preference])
     return {'message': 'Preferences updated successfully'}
 
-@router.get('/me/saved-recipes', status_code=200, response_model=Page[RecipeRead])
-async def get_saved_recipes(
+@router.put('/me/preferences', status_code=200, description='Create/Update preferences in bulk')
+async def set_user_preferences(
+    preferences: List[UserPreferenceCreate],
+    replace: bool = Query(False, description='Delete the preferences not in the list'),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    await db.refresh(current_user, attribute_names=['saved_recipes'])
+    if len(preferences) > PREFERENCES_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f'At most {PREFERENCES_MAX_ITEMS} preferences per request')
 
-    for saved_recipe in current_user.saved_recipes:
-        await db.refresh(saved_recipe, attribute_names=['ingredients'])
+    updated = await upsert_preferences(db, current_user.id, preferences, replace)
+    return {'message': 'Preferences updated successfully', 'updated': updated}
 
-    return paginate(current_user.saved_recipes)
+@router.get('/me/saved-recipes', status_code=200, response_model=Page[RecipeRead])
+async def get_saved_recipes(
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    # Page in the database, ingredients for the whole page in one extra query
+    query = (
+        select(Recipe)
+        .join(user_saved_recipes, user_saved_recipes.c.recipe_id == Recipe.id)
+        .where(user_saved_recipes.c.user_id == current_user.id)
+        .options(selectinload(Recipe.ingredients))
+        .order_by(Recipe.id)
+    )
+    return await paginate(db, query)
 
 @router.post('/me/saved-recipes', status_code=201)
 async def add_saved_recipe(
@@ -74,34 +72,46 @@ async def add_saved_recipe(
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    query = select(Recipe).options(joinedload(Recipe.ingredients)).filter_by(id=saved_recipe.recipe_id)
-    result = await db.execute(query)
-    recipe = result.scalar()
-    if not recipe:
-        raise HTTPException(status_code=404, detail='Recipe not found')
-
-    await db.refresh(current_user, attribute_names=['saved_recipes'])
-    if recipe not in current_user.saved_recipes:
-        current_user.saved_recipes.append(recipe)
-    else:
+    # Single row insert, the user's saved recipes are never loaded
+    if not await save_recipes(db, current_user.id, [saved_recipe.recipe_id]):
         raise HTTPException(status_code=400, detail='Recipe already saved')
 
-    await db.commit()
-
     return {'message': 'Recipe saved successfully'}
 
+@router.post('/me/saved-recipes/bulk', status_code=200, description='Save several recipes')
+async def add_saved_recipes(
+    saved_recipes: SavedRecipeBatch,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    if len(saved_recipes.recipe_ids) > SAVED_RECIPES_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f'At most {SAVED_RECIPES_MAX_ITEMS} recipes per request')
+
+    saved = await save_recipes(db, current_user.id, saved_recipes.recipe_ids)
+    return {'message': 'Recipes saved successfully', 'saved': saved}
+
+@router.delete('/me/saved-recipes', status_code=200, description='Remove several saved recipes')
+async def delete_saved_recipes(
+    recipe_ids: List[int] = Query(..., description='Recipe IDs to remove'),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    if len(recipe_ids) > SAVED_RECIPES_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f'At most {SAVED_RECIPES_MAX_ITEMS} recipes per request')
+
+    removed = await unsave_recipes(db, current_user.id, recipe_ids)
+    return {'message': 'Recipes removed successfully', 'removed': removed}
+
 @router.delete('/me/saved-recipes/{id}', status_code=204)
 async def delete_saved_recipe(
-    recipe: Recipe = Depends(get_recipe_by_id),
+    id: int,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    await db.refresh(current_user, attribute_names=['saved_recipes'])
-    if recipe in current_user.saved_recipes:
-        current_user.saved_recipes.remove(recipe)
-    else:
+    if not await unsave_recipes(db, current_user.id, [id]):
+        # Only on failure: tell a missing recipe from one that was not saved
+        if await db.scalar(select(Recipe.id).filter_by(id=id)) is None:
+            raise HTTPException(status_code=404, detail='Recipe not found')
         raise HTTPException(status_code=400, detail='Recipe not found in saved recipes')
 
-    await db.commit()
-
     return
@@ -1,3 +1,5 @@
+from typing import List
+
 from pydantic import BaseModel
 
 from app.users.constants import PreferenceType
@@ -17,4 +19,7 @@ class UserPreferenceUpdate(BaseModel):
     ingredient_id: int | None = None
 
 class SavedRecipe(BaseModel):
-    recipe_id: int
\ No newline at end of file
+    recipe_id: int
+
+class SavedRecipeBatch(BaseModel):
+    recipe_ids: List[int]
\ No newline at end of file
@@ -0,0 +1,89 @@
+from typing import Dict, Iterable, List
+
+from fastapi import HTTPException
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Ingredient, Recipe, UserPreference, user_saved_recipes
+
+def upsert_preferences_statement(dialect_name: str):
+    """INSERT that updates the preference type when the (user_id, ingredient_id) pair already exists."""
+    if dialect_name == 'mysql':
+        stmt = mysql.insert(UserPreference)
+        return stmt.on_duplicate_key_update(preference_type=stmt.inserted.preference_type)
+
+    # SQLite / PostgreSQL stand-ins
+    dialect = sqlite if dialect_name == 'sqlite' else postgresql
+    stmt = dialect.insert(UserPreference)
+    return stmt.on_conflict_do_update(
+        index_elements=['user_id', 'ingredient_id'], set_={'preference_type': stmt.excluded.preference_type}
+    )
+
+async def upsert_preferences(
+    db: AsyncSession,
+    user_id: int,
+    preferences: Iterable,
+    replace: bool = False
+) -> int:
+    """
+    Create or update the user's preferences in one statement, touching only the given ingredients.
+    With `replace`, preferences for other ingredients are deleted in the same transaction.
+    """
+    # Last entry wins for a repeated ingredient
+    types: Dict[int, str] = {p.ingredient_id: p.preference_type.value for p in preferences}
+
+    if types:
+        result = await db.execute(select(Ingredient.id).where(Ingredient.id.in_(types)))
+        if len(result.all()) != len(types):
+            raise HTTPException(status_code=400, detail='Some ingredient IDs are invalid')
+
+    if replace:
+        await db.execute(
+            delete(UserPreference)
+            .where(UserPreference.user_id == user_id, UserPreference.ingredient_id.not_in(types))
+        )
+    if types:
+        rows = [
+            {'user_id': user_id, 'ingredient_id': ingredient_id, 'preference_type': preference_type}
+            for ingredient_id, preference_type in types.items()
+        ]
+        await db.execute(upsert_preferences_statement(db.get_bind().dialect.name), rows)
+
+    await db.commit()
+    return len(types)
+
+def insert_saved_recipes_statement(dialect_name: str):
+    """INSERT that skips recipes the user already saved."""
+    if dialect_name == 'mysql':
+        return mysql.insert(user_saved_recipes).prefix_with('IGNORE')
+
+    # SQLite / PostgreSQL stand-ins
+    dialect = sqlite if dialect_name == 'sqlite' else postgresql
+    return dialect.insert(user_saved_recipes).on_conflict_do_nothing(index_elements=['user_id', 'recipe_id'])
+
+async def save_recipes(db: AsyncSession, user_id: int, recipe_ids: List[int]) -> int:
+    """Save recipes for the user with one INSERT on the association table. Returns how many were new."""
+    recipe_ids = list(dict.fromkeys(recipe_ids))
+    if not recipe_ids:
+        return 0
+
+    result = await db.execute(select(Recipe.id).where(Recipe.id.in_(recipe_ids)))
+    if len(result.all()) != len(recipe_ids):
+        raise HTTPException(status_code=404, detail='Recipe not found')
+
+    stmt = insert_saved_recipes_statement(db.get_bind().dialect.name)
+    result = await db.execute(stmt.values([{'user_id': user_id, 'recipe_id': recipe_id} for recipe_id in recipe_ids]))
+    await db.commit()
+    return result.rowcount
+
+async def unsave_recipes(db: AsyncSession, user_id: int, recipe_ids: List[int]) -> int:
+    """Delete saved recipes straight from the association table. Returns how many were removed."""
+    if not recipe_ids:
+        return 0
+    result = await db.execute(
+        delete(user_saved_recipes)
+        .where(user_saved_recipes.c.user_id == user_id, user_saved_recipes.c.recipe_id.in_(recipe_ids))
+    )
+    await db.commit()
+    return result.rowcount
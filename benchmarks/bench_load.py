@@ -0,0 +1,253 @@
+"""
+Drive a mixed, concurrent workload against app.main:app and report latency per scenario as JSON.
+
+SQLite and fakeredis stand in for MySQL and Redis, requests go through httpx's ASGI transport,
+so the numbers compare commits on the same machine rather than describe production:
+
+    python -m benchmarks.bench_load --requests 2000 --concurrency 32 --output load.json
+
+The scenario mix and every random choice come from --seed: each step carries its scenario, user
+and random generator, only the interleaving of concurrent steps depends on scheduling. Latency
+is measured until the app finished the request, background tasks included.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from benchmarks.common import WORK_DIR, configure, seed, use_fake_redis
+
+# Uploads stay in the throwaway directory
+IMAGE_DIRECTORY = os.path.join(WORK_DIR, 'images')
+os.makedirs(IMAGE_DIRECTORY)
+configure(IMAGE_DIRECTORY=IMAGE_DIRECTORY)
+
+import httpx
+
+from app.auth.utils import hash_password
+from app.config import settings
+from app.main import app
+
+PASSWORD = 'benchmark'
+TEST_IMAGE = 'app/static/test_image.jpg'
+
+# Relative weights of the mix
+SCENARIOS = {
+    'login': 5,
+    'list_recipes': 35,
+    'search_by_preferences': 20,
+    'create_recipe': 15,
+    'save_recipe': 15,
+    'image_upload': 10,
+}
+
+class VirtualUser:
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        user_id: int,
+        args: argparse.Namespace,
+        rng: random.Random,
+        headers: Dict[str, str] | None = None
+    ):
+        self.client = client
+        self.user_id = user_id
+        self.args = args
+        self.rng = rng
+        self.headers = dict(headers or {})
+
+    @property
+    def username(self) -> str:
+        return f'bench{self.user_id}'
+
+    def own_recipe(self) -> int:
+        # Seeded recipes are spread round-robin over the users
+        return self.rng.randrange(self.user_id, self.args.recipes + 1, self.args.users)
+
+    async def login(self) -> httpx.Response:
+        response = await self.client.post('/auth/login', data={'username': self.username, 'password': PASSWORD})
+        if response.status_code == 200:
+            self.headers = {'Authorization': f'Bearer {response.json()["access_token"]}'}
+        return response
+
+    async def list_recipes(self) -> httpx.Response:
+        pages = max(1, self.args.recipes // 20)
+        return await self.client.get('/recipes/', params={'page': self.rng.randint(1, pages), 'size': 20})
+
+    async def search_by_preferences(self) -> httpx.Response:
+        return await self.client.get('/recipes/search-by-preferences', headers=self.headers)
+
+    async def create_recipe(self) -> httpx.Response:
+        recipe = {
+            'title': f'Load recipe {self.rng.random():.8f}',
+            'instructions': 'Mix everything. ' * 20,
+            'ingredients': self.rng.sample(range(1, self.args.ingredients + 1), self.args.per_recipe),
+        }
+        return await self.client.post('/recipes/', json=recipe, headers=self.headers)
+
+    async def save_recipe(self) -> httpx.Response:
+        recipe_id = self.rng.randint(1, self.args.recipes)
+        return await self.client.post('/users/me/saved-recipes', json={'recipe_id': recipe_id}, headers=self.headers)
+
+    async def image_upload(self) -> httpx.Response:
+        files = {'image_file': ('image.jpg', self.args.image, 'image/jpeg')}
+        return await self.client.patch(f'/recipes/{self.own_recipe()}/image', files=files, headers=self.headers)
+
+# Statuses that count as success, saving an already saved recipe answers 400
+EXPECTED_STATUS = {
+    'login': {200},
+    'list_recipes': {200},
+    'search_by_preferences': {200},
+    'create_recipe': {201},
+    'save_recipe': {201, 400},
+    'image_upload': {201},
+}
+
+def percentile(timings: List[float], percent: float) -> float:
+    # Nearest rank
+    index = max(0, int(len(timings) * percent / 100 + 0.999999) - 1)
+    return timings[index]
+
+def summarize(timings: List[float], errors: int, seconds: float) -> Dict[str, float]:
+    timings = sorted(timings)
+    summary = {'requests': len(timings) + errors, 'errors': errors, 'throughput_rps': round(len(timings) / seconds, 2)}
+    if timings:
+        summary.update({
+            'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+            'p50_ms': round(percentile(timings, 50) * 1000, 3),
+            'p95_ms': round(percentile(timings, 95) * 1000, 3),
+            'p99_ms': round(percentile(timings, 99) * 1000, 3),
+            'max_ms': round(timings[-1] * 1000, 3),
+        })
+    return summary
+
+async def seed_preferences(users: int, ingredients: int, rng: random.Random) -> None:
+    from sqlalchemy import insert
+
+    from app.database import engine
+    from app.models import UserPreference
+
+    rows = [
+        {'user_id': user_id, 'ingredient_id': ingredient_id, 'preference_type': rng.choice(('like', 'like', 'dislike', 'allergy'))}
+        for user_id in range(1, users + 1)
+        for ingredient_id in rng.sample(range(1, ingredients + 1), min(10, ingredients))
+    ]
+    async with engine.begin() as conn:
+        await conn.execute(insert(UserPreference), rows)
+
+async def run(args: argparse.Namespace) -> Dict:
+    password_hash = await hash_password(PASSWORD)
+    await seed(args.recipes, args.ingredients, args.per_recipe, users=args.users, password_hash=password_hash)
+    await seed_preferences(args.users, args.ingredients, random.Random(args.seed))
+
+    plan_rng = random.Random(args.seed)
+    names = list(SCENARIOS)
+    scenarios = plan_rng.choices(names, weights=[SCENARIOS[name] for name in names], k=args.warmup + args.requests)
+    # Scenario, user and random seed of every step, whichever worker ends up running it
+    plan = [
+        (name, plan_rng.randint(1, args.users), f'{args.seed}-{index}')
+        for index, name in enumerate(scenarios)
+    ]
+
+    timings: Dict[str, List[float]] = {name: [] for name in names}
+    errors: Dict[str, int] = {name: 0 for name in names}
+    error_samples: List[str] = []
+
+    async def drive(client: httpx.AsyncClient, tokens: Dict[int, Dict[str, str]], steps: List[Tuple], record: bool) -> None:
+        # Workers share the steps, so the mix does not depend on scheduling
+        pending = iter(steps)
+
+        async def worker() -> None:
+            for name, user_id, step_seed in pending:
+                user = VirtualUser(client, user_id, args, random.Random(step_seed), tokens[user_id])
+                action: Callable[[], Awaitable[httpx.Response]] = getattr(user, name)
+                started = time.perf_counter()
+                response = await action()
+                elapsed = time.perf_counter() - started
+                if not record:
+                    continue
+                if response.status_code in EXPECTED_STATUS[name]:
+                    timings[name].append(elapsed)
+                else:
+                    errors[name] += 1
+                    if len(error_samples) < 10:
+                        error_samples.append(f'{name}: {response.status_code} {response.text[:200]}')
+
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+
+    async with app.router.lifespan_context(app):
+        # Unhandled errors answer 500 and count as errors
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url='http://testserver', timeout=None) as client:
+            users = [
+                VirtualUser(client, user_id, args, random.Random(f'{args.seed}-login-{user_id}'))
+                for user_id in range(1, args.users + 1)
+            ]
+            # Tokens are fetched before measuring, login is also a scenario of its own
+            await asyncio.gather(*(user.login() for user in users))
+            tokens = {user.user_id: user.headers for user in users}
+            await drive(client, tokens, plan[:args.warmup], record=False)
+
+            started = time.perf_counter()
+            await drive(client, tokens, plan[args.warmup:], record=True)
+            seconds = time.perf_counter() - started
+
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'config': {
+            key: value for key, value in vars(args).items() if key not in ('image', 'output')
+        } | {
+            'password_hash_rounds': settings.PASSWORD_HASH_ROUNDS,
+            'response_cache_enabled': settings.RESPONSE_CACHE_ENABLED,
+            'fast_serialization_enabled': settings.FAST_SERIALIZATION_ENABLED,
+        },
+        'seconds': round(seconds, 3),
+        'total': summarize(list(itertools.chain(*timings.values())), sum(errors.values()), seconds),
+        'scenarios': {name: summarize(timings[name], errors[name], seconds) for name in names},
+        'error_samples': error_samples,
+    }
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000, help='measured requests over all scenarios')
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--users', type=int, default=16)
+    parser.add_argument('--recipes', type=int, default=2000)
+    parser.add_argument('--ingredients', type=int, default=500)
+    parser.add_argument('--per-recipe', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    with open(TEST_IMAGE, 'rb') as image_file:
+        args.image = image_file.read()
+
+    use_fake_redis()
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+if __name__ == '__main__':
+    main()
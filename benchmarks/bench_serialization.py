@@ -0,0 +1,77 @@
+"""
+Compare the default and the fast serialization paths of GET /recipes/ and GET /ingredients/.
+
+Runs against a throwaway SQLite database and an in-process fakeredis, the response cache is disabled so every request
+reaches the database:
+
+    python -m benchmarks.bench_serialization --recipes 2000 --requests 200
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks.common import configure, seed, use_fake_redis
+
+configure(
+    RESPONSE_CACHE_ENABLED='false',
+    RECIPE_INDEX_ENABLED='false',
+    SEARCH_INDEX_ENABLED='false',
+    IMAGE_VARIANTS_ENABLED='false',
+)
+
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.main import app
+
+def measure(client: TestClient, url: str, requests: int) -> list:
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = client.get(url)
+        timings.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.text
+    return timings
+
+def report(name: str, timings: list, baseline: list | None = None) -> None:
+    timings = sorted(timings)
+    mean = statistics.mean(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    line = f'  {name:<8} mean {mean * 1000:7.2f} ms   p50 {statistics.median(timings) * 1000:7.2f} ms   p95 {p95 * 1000:7.2f} ms'
+    if baseline:
+        line += f'   x{statistics.mean(baseline) / mean:.2f}'
+    print(line)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--recipes', type=int, default=2000)
+    parser.add_argument('--ingredients', type=int, default=500)
+    parser.add_argument('--per-recipe', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--size', type=int, default=100)
+    args = parser.parse_args()
+
+    use_fake_redis()
+    asyncio.run(seed(args.recipes, args.ingredients, args.per_recipe))
+
+    with TestClient(app) as client:
+        for url in (f'/recipes/?size={args.size}', f'/ingredients/?size={args.size}'):
+            # Same document from both paths
+            settings.FAST_SERIALIZATION_ENABLED = False
+            expected = client.get(url).json()
+            settings.FAST_SERIALIZATION_ENABLED = True
+            assert client.get(url).json() == expected, f'{url}: fast path differs'
+
+            results = {}
+            for name, fast in (('default', False), ('fast', True)):
+                settings.FAST_SERIALIZATION_ENABLED = fast
+                measure(client, url, 10)  # warm up
+                results[name] = measure(client, url, args.requests)
+
+            print(f'GET {url} ({args.requests} requests)')
+            report('default', results['default'])
+            report('fast', results['fast'], results['default'])
+
+if __name__ == '__main__':
+    main()
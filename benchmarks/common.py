@@ -0,0 +1,76 @@
+"""
+Shared setup for the benchmarks: a throwaway SQLite database and local stand-ins for Redis.
+
+`configure()` must run before anything from `app` is imported, settings are read on import.
+"""
+import os
+import random
+import tempfile
+
+WORK_DIR = tempfile.mkdtemp(prefix='cookgen-bench-')
+DATABASE_PATH = os.path.join(WORK_DIR, 'bench.db')
+
+def configure(**overrides: str) -> None:
+    """
+    Point the app at a database in WORK_DIR, other variables already set in the environment win.
+
+    `seed()` drops every table, so an exported DATABASE_URL is refused rather than used.
+    """
+    database_url = f'sqlite+aiosqlite:///{DATABASE_PATH}'
+    if os.environ.get('DATABASE_URL', database_url) != database_url:
+        raise SystemExit('DATABASE_URL is set: the benchmarks drop their database, unset it to use a throwaway one')
+
+    defaults = {
+        'DATABASE_URL': database_url,
+        'BASE_URL': 'http://testserver/',
+        'JWT_SECRET_KEY': 'benchmark',
+        'REDIS_HOST': 'localhost',
+        'REDIS_PORT': '6379',
+        'REDIS_PASS': '',
+        'SEARCH_INDEX_PATH': os.path.join(WORK_DIR, 'search_index.pkl'),
+    }
+    for name, value in {**defaults, **overrides}.items():
+        os.environ.setdefault(name, value)
+
+def use_fake_redis() -> None:
+    """Serve get_redis from an in-process fakeredis server."""
+    try:
+        import fakeredis.aioredis
+    except ImportError:
+        raise SystemExit('fakeredis is required: pip install fakeredis')
+
+    from app import database
+    server = fakeredis.FakeServer()
+    database.create_redis_pool = lambda: fakeredis.aioredis.FakeRedis(server=server).connection_pool
+
+async def seed(recipes: int, ingredients: int, per_recipe: int, users: int = 1, password_hash: str = '-') -> None:
+    """Recreate the schema with `users` users, recipes spread over them round-robin."""
+    from sqlalchemy import insert
+
+    from app.database import Base, engine
+    from app.models import Ingredient, Recipe, User, recipe_ingredient_association
+
+    if engine.url.get_backend_name() != 'sqlite' or engine.url.database != DATABASE_PATH:
+        raise SystemExit(f'Refusing to drop the tables of {engine.url!r}, only the throwaway database in {WORK_DIR} is seeded')
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(User), [
+            {'id': i, 'username': f'bench{i}', 'email': f'bench{i}@example.com', 'password': password_hash}
+            for i in range(1, users + 1)
+        ])
+        await conn.execute(insert(Ingredient), [
+            {'id': i, 'name': f'ingredient {i}', 'description': f'Description of ingredient {i}', 'author_id': 1}
+            for i in range(1, ingredients + 1)
+        ])
+        await conn.execute(insert(Recipe), [
+            {'id': i, 'title': f'Recipe {i}', 'instructions': 'Mix everything. ' * 20, 'author_id': (i - 1) % users + 1}
+            for i in range(1, recipes + 1)
+        ])
+        rng = random.Random(0)
+        await conn.execute(insert(recipe_ingredient_association), [
+            {'recipe_id': recipe_id, 'ingredient_id': ingredient_id}
+            for recipe_id in range(1, recipes + 1)
+            for ingredient_id in rng.sample(range(1, ingredients + 1), per_recipe)
+        ])
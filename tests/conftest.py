@@ -1,13 +1,197 @@
+import re
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Tuple
+
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import event, select
+from sqlalchemy.engine import Engine
+
+from app import database
+from app.auth.cache import user_cache
+from app.config import settings
 from app.main import app
+from app.models import User
+
+# SQLite reports "SCAN <table>" when it reads a table without any index
+SQLITE_FULL_SCAN_RE = re.compile(r'SCAN (?:TABLE )?(\w+)')
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers',
+        'query_budget(max_statements, max_repeats=1): fail when a request of the test runs more SQL '
+        'statements than max_statements, or the same statement shape more than max_repeats times (N+1). '
+        'The user lookup of authentication is not counted',
+    )
+
+# Requests seen by the query budgets, tracked here so budgets do not depend on the metrics middleware
+class BudgetedRequest:
+    __slots__ = ('method', 'path', 'authenticated')
+
+    def __init__(self, method: str, path: str, authenticated: bool = False):
+        self.method = method
+        self.path = path
+        self.authenticated = authenticated
+
+current_request: ContextVar[BudgetedRequest | None] = ContextVar('current_request', default=None)
+active_budgets: List[Dict[BudgetedRequest, List[str]]] = []
+
+class RequestTracker:
+    """ASGI wrapper registering each HTTP request with the active query budgets."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not active_budgets:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get('headers') or ())
+        request = BudgetedRequest(scope['method'], scope['path'], b'authorization' in headers)
+        for requests in active_budgets:
+            requests[request] = []
+        token = current_request.set(request)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_request.reset(token)
 
 @pytest.fixture(scope='session')
 def client() -> TestClient:
-    with TestClient(app) as c:
+    with TestClient(RequestTracker(app)) as c:
         yield c
 
 @pytest.fixture(scope='session')
 def token(client: TestClient) -> str:
     response = client.post('/auth/login', data={'username': 'admin', 'password': 'admin'})
-    return response.json()['access_token']
\ No newline at end of file
+    return response.json()['access_token']
+
+@contextmanager
+def _capture_queries(engine=None):
+    engine = engine or database.engine
+    queries: List[Tuple[str, Any]] = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            queries.append((statement, parameters))
+
+    event.listen(engine.sync_engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield queries
+    finally:
+        event.remove(engine.sync_engine, 'before_cursor_execute', before_cursor_execute)
+
+@pytest.fixture
+def capture_queries():
+    """Context manager collecting the (statement, parameters) sent to the database, or to `engine`."""
+    return _capture_queries
+
+async def _full_table_scans(queries: List[Tuple[str, Any]]) -> List[str]:
+    tables = set(database.Base.metadata.tables)
+    scans = []
+    async with database.engine.connect() as conn:
+        sqlite = conn.dialect.name == 'sqlite'
+        for statement, parameters in queries:
+            if not statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            result = await conn.exec_driver_sql(('EXPLAIN QUERY PLAN ' if sqlite else 'EXPLAIN ') + statement, parameters)
+            for row in result.mappings():
+                if sqlite:
+                    match = SQLITE_FULL_SCAN_RE.fullmatch(row['detail'])
+                    table = match.group(1) if match else None
+                else:
+                    table = row['table'] if row['type'] == 'ALL' else None
+                # Aliases such as recipes_1 point to their table
+                if table and re.sub(r'_\d+$', '', table) in tables:
+                    scans.append(f'{table}: {statement}')
+    return scans
+
+@pytest.fixture
+def full_table_scans(client: TestClient):
+    """EXPLAIN captured queries and list the ones reading a whole table."""
+    def explain(queries: List[Tuple[str, Any]]) -> List[str]:
+        return client.portal.call(_full_table_scans, queries)
+    return explain
+
+# Placeholder lists and numbers vary with the input, not with the query
+PLACEHOLDER_LIST_RE = re.compile(r'\((?:\s*(?:\?|%s|:\w+|\$\d+)\s*,?)+\)')
+NUMBER_RE = re.compile(r'\b\d+\b')
+
+def statement_shape(statement: str) -> str:
+    shape = ' '.join(statement.split())
+    shape = PLACEHOLDER_LIST_RE.sub('(?)', shape)
+    return NUMBER_RE.sub('N', shape)
+
+def auth_lookup_shape() -> str:
+    statement = select(User).where(User.id == 1).compile(dialect=database.engine.dialect)
+    return statement_shape(str(statement))
+
+def _budget_problems(requests: Dict[BudgetedRequest, List[str]], max_statements: int, max_repeats: int) -> List[str]:
+    if not requests:
+        return ['no request was made, the budget checked nothing']
+
+    problems = []
+    auth_lookup = auth_lookup_shape()
+    for request, statements in requests.items():
+        name = f'{request.method} {request.path}'
+        # The user lookup of get_current_user is left out, app.auth.cache may or may not serve it
+        if request.authenticated and auth_lookup in map(statement_shape, statements):
+            statements = list(statements)
+            del statements[list(map(statement_shape, statements)).index(auth_lookup)]
+        if len(statements) > max_statements:
+            problems.append(f'{name}: {len(statements)} statements, budget is {max_statements}')
+        for shape, count in Counter(map(statement_shape, statements)).items():
+            if count > max_repeats:
+                problems.append(f'{name}: {count} times {shape}')
+    return problems
+
+@contextmanager
+def _query_budget(max_statements: int, max_repeats: int = 1, engine=None):
+    # Statements are grouped by the request that ran them, RequestTracker registers every request
+    target = engine.sync_engine if engine is not None else Engine
+    requests: Dict[BudgetedRequest, List[str]] = {}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        request = current_request.get()
+        if request in requests:
+            requests[request].append(statement)
+
+    event.listen(target, 'before_cursor_execute', before_cursor_execute)
+    active_budgets.append(requests)
+    try:
+        yield requests
+    finally:
+        active_budgets.remove(requests)
+        event.remove(target, 'before_cursor_execute', before_cursor_execute)
+
+    problems = _budget_problems(requests, max_statements, max_repeats)
+    if problems:
+        pytest.fail('Query budget exceeded:\n' + '\n'.join(problems), pytrace=False)
+
+@pytest.fixture
+def query_budget():
+    """Context manager failing when a request inside it exceeds the statement budget or repeats a statement."""
+    return _query_budget
+
+async def _warm_user_cache() -> None:
+    # Every user cached, so budgets do not depend on the requests of earlier tests
+    user_cache.clear()
+    if settings.USER_CACHE_ENABLED:
+        async with database.AsyncSessionLocal() as db:
+            for user in (await db.execute(select(User))).scalars():
+                user_cache.store(str(user.id), user)
+
+@pytest.fixture(autouse=True)
+def _query_budget_marker(request):
+    marker = request.node.get_closest_marker('query_budget')
+    if marker is None:
+        yield
+        return
+    # Log in before measuring
+    if 'token' in request.fixturenames:
+        request.getfixturevalue('token')
+    request.getfixturevalue('client').portal.call(_warm_user_cache)
+    with _query_budget(*marker.args, **marker.kwargs):
+        yield
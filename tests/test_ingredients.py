@@ -1,3 +1,4 @@
+import pytest
 from fastapi.testclient import TestClient
 
 # Test Data
@@ -6,24 +7,79 @@ test_ingredient = {
     'description': 'This is a test ingredient'
 }
 
+@pytest.mark.query_budget(2)
 def test_get_ingredients(client: TestClient):
     response = client.get('/ingredients/')
     assert response.status_code == 200
     assert 'items' in response.json()
 
+@pytest.mark.query_budget(3)
 def test_create_ingredient(client: TestClient, token: str):
     headers = {'Authorization': f'Bearer {token}'}
     response = client.post('/ingredients/', json=test_ingredient, headers=headers)
     assert response.status_code == 201
     assert response.json()['name'] == test_ingredient['name']
 
+@pytest.mark.query_budget(1)
 def test_get_ingredient(client: TestClient):
     response = client.get('/ingredients/21')
     assert response.status_code == 200
     assert response.json()['name'] == test_ingredient['name']
 
+@pytest.mark.query_budget(2)
 def test_update_ingredient(client: TestClient, token: str):
     headers = {'Authorization': f'Bearer {token}'}
     updated_data = {'name': 'Updated Ingredient', 'description': 'Updated description'}
     response = client.put('/ingredients/21', json=updated_data, headers=headers)
-    assert response.status_code == 200
\ No newline at end of file
+    assert response.status_code == 200
+
+@pytest.mark.query_budget(1)
+def test_get_ingredients_by_cursor(client: TestClient):
+    response = client.get('/ingredients/cursor', params={'size': 5})
+    assert response.status_code == 200
+    first_page = response.json()
+    assert len(first_page['items']) == 5
+    assert first_page['prev_cursor'] is None
+
+    response = client.get('/ingredients/cursor', params={'size': 5, 'cursor': first_page['next_cursor']})
+    assert response.status_code == 200
+    second_page = response.json()
+    assert second_page['items'][0]['name'] > first_page['items'][-1]['name']
+
+    response = client.get('/ingredients/cursor', params={'size': 5, 'cursor': second_page['prev_cursor']})
+    assert response.status_code == 200
+    assert response.json()['items'] == first_page['items']
+
+@pytest.mark.query_budget(0)
+def test_get_ingredients_invalid_cursor(client: TestClient):
+    response = client.get('/ingredients/cursor', params={'cursor': 'not-a-cursor'})
+    assert response.status_code == 400
+
+@pytest.mark.query_budget(2)
+def test_load_ingredients_csv(client: TestClient, token: str):
+    headers = {'Authorization': f'Bearer {token}'}
+    content = 'name,description\nTomato,Updated tomato\nBulk Ingredient,Loaded from CSV\n,Skipped row\n'
+    response = client.post('/ingredients/bulk', files={'csv_file': ('ingredients.csv', content, 'text/csv')}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()['loaded'] == 2
+    assert response.json()['skipped'] == 1
+
+    response = client.get('/ingredients/1')
+    assert response.json()['description'] == 'Updated tomato'
+
+@pytest.mark.query_budget(3)
+def test_load_ingredients_csv_other_author(client: TestClient):
+    user = {'username': 'csvuser', 'password': 'csvpassword', 'full_name': 'csv user', 'email': 'csv@example.com'}
+    client.post('/auth/register', json=user)
+    token = client.post('/auth/login', data=user).json()['access_token']
+
+    # Tomato belongs to the admin, it is skipped instead of overwritten
+    content = 'name,description\nTomato,Not my tomato\nCSV User Ingredient,Mine\n'
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.post('/ingredients/bulk', files={'csv_file': ('ingredients.csv', content, 'text/csv')}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()['loaded'] == 1
+    assert response.json()['skipped'] == 1
+
+    response = client.get('/ingredients/1')
+    assert response.json()['description'] != 'Not my tomato'
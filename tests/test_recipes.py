@@ -1,4 +1,25 @@
+import asyncio
+import os
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException, Request
 from fastapi.testclient import TestClient
+from PIL import Image
+from sqlalchemy import delete, select
+
+from app import database
+from app.cache import ResponseCache, invalidate_all, invalidate_tags, recipe_tag
+from app.config import settings
+from app.limits import BodySizeLimitMiddleware
+from app.models import Ingredient, Recipe, recipe_ingredient_association
+from app.recipes.constants import IMAGE_FORM_OVERHEAD
+from app.recipes.images import IMAGE_VARIANTS, existing_variants, generate_variants, image_relpath, variant_relpath
+from app.recipes.index import RecipeIndex
+from app.recipes.search import get_fingerprint, text_index
+from app.recipes.sync import IndexSync
+from app.recipes.utils import image_lock, release_image
+from tests.conftest import RequestTracker
 
 # Test Data
 test_recipe = {
@@ -7,22 +28,87 @@ test_recipe = {
 	'instructions': 'test instructions'
 }
 
+# Scope of a GET /recipes/1 for ResponseCache
+cache_scope = {
+    'type': 'http', 'method': 'GET', 'scheme': 'http', 'server': ('testserver', 80),
+    'path': '/recipes/1', 'query_string': b'', 'headers': []
+}
+
+@pytest.mark.query_budget(2)
 def test_get_recipes(client: TestClient):
     response = client.get('/recipes/')
     assert response.status_code == 200
     assert 'items' in response.json()
 
+@pytest.mark.query_budget(1)
+def test_get_recipes_by_cursor(client: TestClient):
+    response = client.get('/recipes/cursor')
+    assert response.status_code == 200
+    assert 'items' in response.json()
+    assert 'next_cursor' in response.json()
+
+@pytest.mark.query_budget(4)
 def test_create_recipe(client: TestClient, token: str):
     headers = {'Authorization': f'Bearer {token}'}
     response = client.post('/recipes/', json=test_recipe, headers=headers)
     assert response.status_code == 201
     assert response.json()['title'] == test_recipe['title']
 
+@pytest.mark.query_budget(1)
 def test_get_recipe(client: TestClient):
     response = client.get('/recipes/1')
     assert response.status_code == 200
     assert response.json()['title'] == test_recipe['title']
 
+@pytest.mark.skipif(not settings.RESPONSE_CACHE_ENABLED, reason='response cache disabled')
+@pytest.mark.query_budget(0)
+def test_get_recipe_cached(client: TestClient):
+    response = client.get('/recipes/1')
+    etag = response.headers['etag']
+    assert client.get('/recipes/1').headers['etag'] == etag
+
+    response = client.get('/recipes/1', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+@pytest.mark.skipif(not settings.RESPONSE_CACHE_ENABLED, reason='response cache disabled')
+def test_response_cache_stale_fill(client: TestClient):
+    # A body read before an invalidation is not stored after it
+
+    async def run():
+        r = await database.get_redis()
+        cache = ResponseCache(Request(cache_scope), r, settings.RESPONSE_CACHE_TTL)
+        await cache.get()
+        await invalidate_tags(r, recipe_tag(1))
+        await cache.set({'title': 'stale'}, [recipe_tag(1)])
+        stale = await ResponseCache(Request(cache_scope), r, settings.RESPONSE_CACHE_TTL).get()
+
+        # Without an invalidation in between the body is stored, and invalidate_all drops it
+        await cache.get()
+        await cache.set({'title': 'fresh'}, [recipe_tag(1)])
+        fresh = await ResponseCache(Request(cache_scope), r, settings.RESPONSE_CACHE_TTL).get()
+        await invalidate_all(r)
+        cleared = await ResponseCache(Request(cache_scope), r, settings.RESPONSE_CACHE_TTL).get()
+        return stale, fresh, cleared
+
+    stale, fresh, cleared = client.portal.call(run)
+    assert stale is None
+    assert fresh.body == b'{"title":"fresh"}'
+    assert cleared is None
+
+@pytest.mark.skipif(not settings.RESPONSE_CACHE_ENABLED, reason='response cache disabled')
+def test_response_cache_replica_lag(client: TestClient):
+    # Right after an invalidation a replica may still serve the old row
+    async def run():
+        r = await database.get_redis()
+        await invalidate_tags(r, recipe_tag(1))
+        cache = ResponseCache(Request(cache_scope), r, settings.RESPONSE_CACHE_TTL, replica=True)
+        await cache.get()
+        await cache.set({'title': 'lagging'}, [recipe_tag(1)])
+        return await ResponseCache(Request(cache_scope), r, settings.RESPONSE_CACHE_TTL).get()
+
+    assert client.portal.call(run) is None
+
+@pytest.mark.query_budget(3)
 def test_update_recipe(client: TestClient, token: str):
     headers = {'Authorization': f'Bearer {token}'}
     updated_data = {'title': 'Updated Recipe', 'instructions': 'Updated instrutions'}
@@ -30,6 +116,10 @@ def test_update_recipe(client: TestClient, token: str):
     assert response.status_code == 200
     assert response.json()['title'] == updated_data['title']
 
+    # Cached response was invalidated
+    assert client.get('/recipes/1').json()['title'] == updated_data['title']
+
+@pytest.mark.query_budget(3)
 def test_update_image(client: TestClient, token: str):
     headers = {'Authorization': f'Bearer {token}'}
     with open('app/static/test_image.jpg', 'rb') as image_file:
@@ -37,13 +127,438 @@ def test_update_image(client: TestClient, token: str):
     assert response.status_code == 201
     assert 'image_name' in response.json()
 
+@pytest.mark.query_budget(1)
+def test_get_recipe_image(client: TestClient):
+    response = client.get('/recipes/1/image')
+    assert response.status_code == 200
+    image_name = client.get('/recipes/1').json()['image_name']
+    assert response.json()['image_url'].endswith(f'/static/images/{image_name[:2]}/{image_name}.jpg')
+    if settings.IMAGE_VARIANTS_ENABLED:
+        # Only the variants on disk are advertised
+        variants = response.json()['variants']
+        assert set(variants) == set(existing_variants(settings.IMAGE_DIRECTORY, image_name))
+        for variant, url in variants.items():
+            assert url.endswith(f'/static/images/{variant}/{image_name[:2]}/{image_name}.webp')
+
+@pytest.mark.skipif(not settings.IMAGE_VARIANTS_ENABLED, reason='image variants disabled')
+@pytest.mark.query_budget(1)
+def test_generate_image_variants(client: TestClient, tmp_path, monkeypatch):
+    image_name = client.get('/recipes/1').json()['image_name']
+    source_path = os.path.join(settings.IMAGE_DIRECTORY, image_relpath(image_name, 'jpg'))
+
+    # Not generated in this directory yet
+    monkeypatch.setattr(settings, 'IMAGE_DIRECTORY', str(tmp_path))
+    assert client.get('/recipes/1/image').json()['variants'] == {}
+
+    generate_variants(source_path, str(tmp_path), image_name)
+    assert set(client.get('/recipes/1/image').json()['variants']) == set(IMAGE_VARIANTS)
+    for variant, max_edge in IMAGE_VARIANTS.items():
+        with Image.open(tmp_path / variant_relpath(variant, image_name)) as image:
+            assert image.format == 'WEBP'
+            assert max(image.size) == max_edge
+
+# Static files never reach the database, the recipe read may when the response cache is off
+@pytest.mark.query_budget(0 if settings.RESPONSE_CACHE_ENABLED else 1)
+def test_get_image_file_cached(client: TestClient):
+    image_name = client.get('/recipes/1').json()['image_name']
+    url = f'/static/images/{image_name[:2]}/{image_name}.jpg'
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers['etag'] == f'"{image_name}"'
+    assert 'immutable' in response.headers['cache-control']
+
+    response = client.get(url, headers={'If-None-Match': f'"{image_name}"'})
+    assert response.status_code == 304
+
+    response = client.get(url, headers={'Range': 'bytes=0-9'})
+    assert response.status_code == 206
+    assert len(response.content) == 10
+
+@pytest.mark.query_budget(4)
+def test_update_image_deduplicated(client: TestClient, token: str):
+    headers = {'Authorization': f'Bearer {token}'}
+    recipe_id = client.post('/recipes/', json=test_recipe, headers=headers).json()['id']
+    with open('app/static/test_image.jpg', 'rb') as image_file:
+        response = client.patch(f'/recipes/{recipe_id}/image', files={'image_file': image_file}, headers=headers)
+    assert response.status_code == 201
+    assert response.json()['image_name'] == client.get('/recipes/1').json()['image_name']
+
+@pytest.mark.query_budget(1)
+def test_update_image_not_an_image(client: TestClient, token: str):
+    headers = {'Authorization': f'Bearer {token}'}
+    files = {'image_file': ('image.jpg', b'not really an image', 'image/jpeg')}
+    response = client.patch('/recipes/1/image', files=files, headers=headers)
+    assert response.status_code == 415
+
+@pytest.mark.query_budget(0)
+def test_update_image_too_large(client: TestClient, token: str):
+    headers = {'Authorization': f'Bearer {token}'}
+    files = {'image_file': ('image.jpg', b'\xff\xd8\xff' + bytes(settings.IMAGE_MAX_SIZE + IMAGE_FORM_OVERHEAD), 'image/jpeg')}
+    response = client.patch('/recipes/1/image', files=files, headers=headers)
+    assert response.status_code == 413
+
+def test_body_size_limit_streamed(client: TestClient):
+    # Without a Content-Length the body is counted as it is received
+    async def read_body(scope, receive, send):
+        while (await receive()).get('more_body'):
+            pass
+
+    async def receive():
+        return {'type': 'http.request', 'body': bytes(1024), 'more_body': True}
+
+    limited = BodySizeLimitMiddleware(read_body, max_size=4096, path=r'/recipes/\d+/image')
+    scope = {'type': 'http', 'method': 'PATCH', 'path': '/recipes/1/image', 'headers': []}
+    with pytest.raises(HTTPException) as error:
+        client.portal.call(limited, scope, receive, None)
+    assert error.value.status_code == 413
+
+def test_release_image_waits_for_upload(client: TestClient):
+    # A release blocked behind an upload of the same content counts its reference afterwards
+    async def run():
+        r = await database.get_redis()
+        order = []
+
+        async def release():
+            async with database.AsyncSessionLocal() as db:
+                await release_image(db, r, 'f' * 64, 'jpg')
+            order.append('released')
+
+        async with image_lock(r, 'f' * 64):
+            task = asyncio.create_task(release())
+            await asyncio.sleep(0.1)
+            order.append('stored')
+        await task
+        return order
+
+    assert client.portal.call(run) == ['stored', 'released']
+
+@pytest.mark.query_budget(5)
 def test_delete_recipe(client: TestClient, token: str):
     headers = {'Authorization': f'Bearer {token}'}
     response = client.delete('/recipes/1', headers=headers)
     assert response.status_code == 204
 
+@pytest.mark.query_budget(1)
 def test_search_by_preferences(client: TestClient, token: str):
     headers = {'Authorization': f'Bearer {token}'}
     response = client.get('/recipes/search-by-preferences', headers=headers)
     assert response.status_code == 200
-    assert 'items' in response.json()
\ No newline at end of file
+    assert 'items' in response.json()
+
+@pytest.mark.query_budget(5)
+def test_search_by_preferences_index(client: TestClient, token: str):
+    headers = {'Authorization': f'Bearer {token}'}
+    liked = client.post('/recipes/', json={**test_recipe, 'ingredients': [6, 7]}, headers=headers).json()
+    disliked = client.post('/recipes/', json={**test_recipe, 'ingredients': [6, 8]}, headers=headers).json()
+    client.post('/users/me/preferences', json={'ingredient_id': 6, 'preference_type': 'like'}, headers=headers)
+    client.post('/users/me/preferences', json={'ingredient_id': 8, 'preference_type': 'allergy'}, headers=headers)
+
+    response = client.get('/recipes/search-by-preferences', headers=headers)
+    assert response.status_code == 200
+    recipe_ids = [recipe['id'] for recipe in response.json()['items']]
+    assert liked['id'] in recipe_ids
+    assert disliked['id'] not in recipe_ids
+
+    # Ranked search puts the recipes with more liked ingredients first
+    client.post('/users/me/preferences', json={'ingredient_id': 7, 'preference_type': 'like'}, headers=headers)
+    single = client.post('/recipes/', json={**test_recipe, 'ingredients': [7, 9, 10]}, headers=headers).json()
+    response = client.get('/recipes/search-by-preferences', params={'ranked': True}, headers=headers)
+    assert response.status_code == 200
+    recipe_ids = [recipe['id'] for recipe in response.json()['items']]
+    assert recipe_ids.index(liked['id']) < recipe_ids.index(single['id'])
+
+    # Index follows recipe updates
+    client.put(f'/recipes/{liked["id"]}', json={'ingredients': [7, 8]}, headers=headers)
+    response = client.get('/recipes/search-by-preferences', headers=headers)
+    assert liked['id'] not in [recipe['id'] for recipe in response.json()['items']]
+
+@pytest.mark.query_budget(4)
+def test_search_by_preferences_ranked_without_index(client: TestClient, token: str, monkeypatch):
+    headers = {'Authorization': f'Bearer {token}'}
+    both = client.post('/recipes/', json={**test_recipe, 'ingredients': [6, 7]}, headers=headers).json()
+    single = client.post('/recipes/', json={**test_recipe, 'ingredients': [7, 9, 10]}, headers=headers).json()
+
+    # Ranked in SQL when the index is not available
+    monkeypatch.setattr(settings, 'RECIPE_INDEX_ENABLED', False)
+    response = client.get('/recipes/search-by-preferences', params={'ranked': True}, headers=headers)
+    assert response.status_code == 200
+    recipe_ids = [recipe['id'] for recipe in response.json()['items']]
+    assert recipe_ids.index(both['id']) < recipe_ids.index(single['id'])
+
+def test_rank_ties_across_pages():
+    # Same ingredients and age, so every score ties: pages follow the ids
+    index = RecipeIndex()
+    recipe_ids = [17, 3, 29, 11, 5, 23, 2, 31, 7, 13, 19, 37]
+    for recipe_id in recipe_ids:
+        index.add(recipe_id, [1, 2], created_at=datetime(2000, 1, 1))
+
+    ranked, total = index.rank([1])
+    assert total == len(recipe_ids)
+    assert list(ranked) == sorted(recipe_ids)
+    for limit in range(1, len(recipe_ids)):
+        assert list(index.rank([1], limit=limit)[0]) == sorted(recipe_ids)[:limit]
+
+@pytest.mark.query_budget(4)
+def test_search_recipes(client: TestClient, token: str):
+    headers = {'Authorization': f'Bearer {token}'}
+    recipe = client.post('/recipes/', json={**test_recipe, 'title': 'Tarta de limón', 'gluten_free': True}, headers=headers).json()
+
+    response = client.get('/recipes/search', params={'q': 'limon tarta'})
+    assert response.status_code == 200
+    assert response.json()['items'][0]['id'] == recipe['id']
+
+    response = client.get('/recipes/search', params={'q': 'limon', 'low_carb': True})
+    assert recipe['id'] not in [item['id'] for item in response.json()['items']]
+
+    client.delete(f'/recipes/{recipe["id"]}', headers=headers)
+    response = client.get('/recipes/search', params={'q': 'limon'})
+    assert recipe['id'] not in [item['id'] for item in response.json()['items']]
+
+@pytest.mark.query_budget(4)
+def test_search_recipes_without_index(client: TestClient, token: str, monkeypatch):
+    headers = {'Authorization': f'Bearer {token}'}
+    recipe = client.post('/recipes/', json={**test_recipe, 'title': 'Pan 50%_integral'}, headers=headers).json()
+
+    # LIKE wildcards in the query match only themselves
+    monkeypatch.setattr(settings, 'SEARCH_INDEX_ENABLED', False)
+    response = client.get('/recipes/search', params={'q': '%_'})
+    assert response.status_code == 200
+    assert [item['id'] for item in response.json()['items']] == [recipe['id']]
+
+@pytest.mark.query_budget(4)
+def test_search_by_pantry(client: TestClient, token: str):
+    headers = {'Authorization': f'Bearer {token}'}
+    full = client.post('/recipes/', json={**test_recipe, 'ingredients': [11, 12]}, headers=headers).json()
+    partial = client.post('/recipes/', json={**test_recipe, 'ingredients': [11, 12, 13]}, headers=headers).json()
+
+    response = client.get('/recipes/pantry', params={'ingredients': [11, 12]})
+    assert response.status_code == 200
+    recipe_ids = [item['id'] for item in response.json()['items']]
+    assert full['id'] in recipe_ids
+    assert partial['id'] not in recipe_ids
+
+    response = client.get('/recipes/pantry', params={'ingredients': [11, 12], 'max_missing': 1})
+    items = response.json()['items']
+    assert [item['id'] for item in items][:2] == [full['id'], partial['id']]
+    assert items[0]['coverage'] == 1
+    assert items[1]['missing'] == 1
+
+# The delete also reloads the recipes that used the ingredient into the index
+@pytest.mark.query_budget(7)
+def test_delete_ingredient_pantry(client: TestClient, token: str):
+    headers = {'Authorization': f'Bearer {token}'}
+    kept = client.post('/ingredients/', json={'name': 'Pantry Kept'}, headers=headers).json()['id']
+    deleted = client.post('/ingredients/', json={'name': 'Pantry Deleted'}, headers=headers).json()['id']
+    recipe = {'title': 'Pantry Recipe', 'instructions': 'Mix', 'ingredients': [kept, deleted]}
+    recipe_id = client.post('/recipes/', json=recipe, headers=headers).json()['id']
+
+    assert client.delete(f'/ingredients/{deleted}', headers=headers).status_code == 204
+
+    # The recipe now only needs the kept ingredient
+    items = client.get('/recipes/pantry', params={'ingredients': [kept]}).json()['items']
+    assert [(item['id'], item['missing']) for item in items] == [(recipe_id, 0)]
+
+@pytest.mark.skipif(not settings.SEARCH_INDEX_ENABLED, reason='search index disabled')
+@pytest.mark.query_budget(7)
+def test_delete_ingredient_search(client: TestClient, token: str):
+    headers = {'Authorization': f'Bearer {token}'}
+    ingredient_id = client.post('/ingredients/', json={'name': 'Zzyzx'}, headers=headers).json()['id']
+    recipe = {'title': 'Search Recipe', 'instructions': 'Mix', 'ingredients': [1, ingredient_id]}
+    recipe_id = client.post('/recipes/', json=recipe, headers=headers).json()['id']
+    assert [item['id'] for item in client.get('/recipes/search', params={'q': 'zzyzx'}).json()['items']] == [recipe_id]
+
+    assert client.delete(f'/ingredients/{ingredient_id}', headers=headers).status_code == 204
+
+    # Its name no longer matches the recipe, and nothing is left of it in the index
+    assert client.get('/recipes/search', params={'q': 'zzyzx'}).json()['items'] == []
+    assert ingredient_id not in text_index._ingredient_terms
+    assert ingredient_id not in text_index._ingredient_docs
+
+@pytest.mark.query_budget(4)
+def test_search_by_pantry_without_index(client: TestClient, token: str, monkeypatch):
+    headers = {'Authorization': f'Bearer {token}'}
+    full = client.post('/recipes/', json={**test_recipe, 'ingredients': [16, 17]}, headers=headers).json()
+    partial = client.post('/recipes/', json={**test_recipe, 'ingredients': [16, 17, 18]}, headers=headers).json()
+
+    # Counted in SQL when the index is not available
+    monkeypatch.setattr(settings, 'RECIPE_INDEX_ENABLED', False)
+    response = client.get('/recipes/pantry', params={'ingredients': [16, 17]})
+    assert response.status_code == 200
+    assert [item['id'] for item in response.json()['items']] == [full['id']]
+
+    response = client.get('/recipes/pantry', params={'ingredients': [16, 17], 'max_missing': 1})
+    items = response.json()['items']
+    assert [item['id'] for item in items] == [full['id'], partial['id']]
+    assert response.json()['total'] == 2
+    assert (items[0]['coverage'], items[1]['matched'], items[1]['missing']) == (1, 2, 1)
+
+@pytest.mark.query_budget(5)
+def test_search_index_fingerprint(client: TestClient, token: str):
+    headers = {'Authorization': f'Bearer {token}'}
+
+    async def fingerprint():
+        async with database.AsyncSessionLocal() as db:
+            return await get_fingerprint(db)
+
+    recipe = client.post('/recipes/', json={**test_recipe, 'ingredients': [1, 2]}, headers=headers).json()
+    before = client.portal.call(fingerprint)
+
+    # Only the ingredient links change, the saved index would be stale
+    client.put(f'/recipes/{recipe["id"]}', json={'ingredients': [1, 3]}, headers=headers)
+    assert client.portal.call(fingerprint) != before
+
+# The first search reloads the changed recipe from the primary, then reads its page
+@pytest.mark.query_budget(4, max_repeats=2)
+def test_index_follows_other_workers(client: TestClient):
+    other_worker = IndexSync()
+
+    async def create_recipe() -> int:
+        async with database.AsyncSessionLocal() as db:
+            ingredients = (await db.execute(select(Ingredient).where(Ingredient.id.in_([14, 15])))).scalars().all()
+            recipe = Recipe(**test_recipe | {'ingredients': ingredients}, author_id=1)
+            db.add(recipe)
+            await db.commit()
+        await other_worker.publish(await database.get_redis(), recipes=[recipe.id])
+        return recipe.id
+
+    async def delete_recipe(recipe_id: int) -> None:
+        async with database.AsyncSessionLocal() as db:
+            await db.execute(delete(recipe_ingredient_association).where(recipe_ingredient_association.c.recipe_id == recipe_id))
+            await db.execute(delete(Recipe).where(Recipe.id == recipe_id))
+            await db.commit()
+        await other_worker.publish(await database.get_redis(), recipes=[recipe_id])
+
+    # Written by another process, this one only hears about it through Redis
+    recipe_id = client.portal.call(create_recipe)
+    response = client.get('/recipes/pantry', params={'ingredients': [14, 15]})
+    assert recipe_id in [item['id'] for item in response.json()['items']]
+
+    client.portal.call(delete_recipe, recipe_id)
+    response = client.get('/recipes/pantry', params={'ingredients': [14, 15]})
+    assert recipe_id not in [item['id'] for item in response.json()['items']]
+
+# One INSERT for the recipes and one for their ingredients
+@pytest.mark.query_budget(3)
+def test_create_recipes_bulk(client: TestClient, token: str):
+    headers = {'Authorization': f'Bearer {token}'}
+    recipes = [
+        {**test_recipe, 'title': 'Bulk Recipe 1'},
+        {**test_recipe, 'title': 'Bulk Recipe 2', 'ingredients': [1, 999999]},
+        {**test_recipe, 'title': 'Bulk Recipe 3', 'ingredients': [2, 3]},
+    ]
+    response = client.post('/recipes/bulk', json=recipes, headers=headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data['created']) == 2
+    assert [error['index'] for error in data['errors']] == [1]
+
+    response = client.get(f'/recipes/{data["created"][1]}')
+    assert response.status_code == 200
+    assert [ingredient['id'] for ingredient in response.json()['ingredients']] == [2, 3]
+
+# Recipes created in the same instant are ordered by id, a page boundary falls between them
+@pytest.mark.query_budget(3)
+def test_get_recipes_by_cursor_traversal(client: TestClient, monkeypatch):
+    async def create_recipes() -> list:
+        async with database.AsyncSessionLocal() as db:
+            created_at = datetime(2000, 1, 1)
+            recipes = [Recipe(title=f'Tied Recipe {i}', instructions='test instructions', author_id=1, created_at=created_at) for i in range(5)]
+            db.add_all(recipes)
+            await db.commit()
+            ordered = await db.scalars(select(Recipe.id).order_by(Recipe.created_at, Recipe.id))
+            return [[recipe.id for recipe in recipes], ordered.all()]
+
+    async def delete_recipes(recipe_ids: list) -> None:
+        async with database.AsyncSessionLocal() as db:
+            await db.execute(delete(Recipe).where(Recipe.id.in_(recipe_ids)))
+            await db.commit()
+
+    tied, expected = client.portal.call(create_recipes)
+    pages, cursor = [], None
+    while True:
+        page = client.get('/recipes/cursor', params={'size': 3, 'cursor': cursor}).json()
+        pages.append(page)
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert [item['id'] for page in pages for item in page['items']] == expected
+    assert pages[0]['prev_cursor'] is None
+
+    # Walking back from the last page gives the same pages
+    for page, previous in zip(reversed(pages), reversed(pages[:-1])):
+        response = client.get('/recipes/cursor', params={'size': 3, 'cursor': page['prev_cursor']})
+        assert response.json()['items'] == previous['items']
+
+    # Offset pages follow the same order on both serialization paths
+    monkeypatch.setattr(settings, 'RESPONSE_CACHE_ENABLED', False)
+    for fast in (False, True):
+        monkeypatch.setattr(settings, 'FAST_SERIALIZATION_ENABLED', fast)
+        response = client.get('/recipes/', params={'size': 100})
+        assert [item['id'] for item in response.json()['items']] == expected
+
+    client.portal.call(delete_recipes, tied)
+
+def test_query_budget_reports_repeats(client: TestClient, query_budget):
+    # A synthetic endpoint loading recipes one by one
+    async def n_plus_one(scope, receive, send):
+        async with database.AsyncSessionLocal() as db:
+            for recipe_id in (1, 2, 3):
+                await db.execute(select(Recipe.id).where(Recipe.id == recipe_id))
+
+    scope = {'type': 'http', 'method': 'GET', 'path': '/n-plus-one', 'headers': []}
+    with pytest.raises(pytest.fail.Exception, match=r'GET /n-plus-one: 3 times SELECT recipes\.id FROM recipes WHERE'):
+        with query_budget(10):
+            client.portal.call(RequestTracker(n_plus_one), scope, None, None)
+
+    with pytest.raises(pytest.fail.Exception, match='no request was made'):
+        with query_budget(10):
+            pass
+
+@pytest.mark.query_budget(3)
+def test_recipes_query_plans(client: TestClient, token: str, capture_queries, full_table_scans):
+    headers = {'Authorization': f'Bearer {token}'}
+    with capture_queries() as queries:
+        # Uncached page size, so the list query reaches the database
+        assert client.get('/recipes/?size=7').status_code == 200
+        assert client.get('/recipes/search-by-preferences', headers=headers).status_code == 200
+    assert queries
+    assert full_table_scans(queries) == []
+
+@pytest.mark.query_budget(3)
+def test_read_replica_routing(client: TestClient, token: str, capture_queries, monkeypatch):
+    headers = {'Authorization': f'Bearer {token}'}
+    # The primary database stands in for a replica
+    router = database.ReplicaRouter()
+    router.configure([database.engine.url.render_as_string(hide_password=False), 'sqlite+aiosqlite:////nonexistent/replica.db'])
+    monkeypatch.setattr(database, 'replica_router', router)
+    client.cookies.clear()
+
+    try:
+        # Round robin, the unreachable replica fails over to the working one
+        for _ in range(2):
+            with capture_queries(router.engines[0]) as queries:
+                assert client.get('/recipes/cursor').status_code == 200
+            assert queries
+
+        # Read-your-writes: right after a write, reads go to the primary
+        assert client.put('/users/me/preferences', json=[], headers=headers).status_code == 200
+        with capture_queries(router.engines[0]) as queries:
+            assert client.get('/recipes/cursor').status_code == 200
+        assert not queries
+
+        # Every replica gets its own pool series
+        assert set(client.get('/health').json()['database_pools']) == {'primary', 'replica0', 'replica1'}
+        if settings.METRICS_ENABLED:
+            assert 'db_pool_checkout_timeouts_total{engine="replica1"} 0' in client.get('/metrics').text
+    finally:
+        client.cookies.clear()
+        client.portal.call(router.dispose)
+
+@pytest.mark.query_budget(3)
+def test_fast_serialization(client: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, 'RESPONSE_CACHE_ENABLED', False)
+    for url in ('/recipes/?size=100', '/ingredients/?size=100'):
+        expected = client.get(url).json()
+        monkeypatch.setattr(settings, 'FAST_SERIALIZATION_ENABLED', True)
+        assert client.get(url).json() == expected
+        monkeypatch.setattr(settings, 'FAST_SERIALIZATION_ENABLED', False)
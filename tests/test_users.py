@@ -1,5 +1,13 @@
+from typing import List
+
+import pytest
 from fastapi.testclient import TestClient
 
+from app import database
+from app.auth.cache import user_cache
+from app.config import settings
+from app.models import Recipe
+
 # Test Data
 test_preference = {
     'ingredient_id': 1,
@@ -10,26 +18,111 @@ test_saved_recipe = {
     'recipe_id': 1 
 }
 
+@pytest.fixture(scope='module')
+def recipe_ids(client: TestClient) -> List[int]:
+    # Recipes to save, written straight to the database so no query budget sees them
+    async def create_recipes() -> List[int]:
+        async with database.AsyncSessionLocal() as db:
+            recipes = [Recipe(title=f'Saved Recipe {i}', instructions='test instructions', author_id=1) for i in range(3)]
+            db.add_all(recipes)
+            await db.commit()
+            return [recipe.id for recipe in recipes]
+    return client.portal.call(create_recipes)
+
+@pytest.mark.query_budget(0)
 def test_get_me(client: TestClient, token: str):
     headers = {'Authorization': f'Bearer {token}'}
     response = client.get('/users/me', headers=headers)
     assert response.status_code == 200
     assert 'id' in response.json()
 
+@pytest.mark.skipif(not settings.USER_CACHE_ENABLED, reason='user cache disabled')
+@pytest.mark.query_budget(0)
+def test_get_me_cached(client: TestClient, token: str):
+    headers = {'Authorization': f'Bearer {token}'}
+    hits = user_cache.hits
+    response = client.get('/users/me', headers=headers)
+    assert response.status_code == 200
+    assert response.json()['username'] == 'admin'
+    assert user_cache.hits == hits + 1
+
+@pytest.mark.query_budget(1)
 def test_get_preferences(client: TestClient, token: str):
     headers = {'Authorization': f'Bearer {token}'}
     response = client.get('/users/me/preferences', headers=headers)
     assert response.status_code == 200
     assert isinstance(response.json(), list)
 
+@pytest.mark.query_budget(2)
 def test_set_user_preference(client: TestClient, token: str):
     headers = {'Authorization': f'Bearer {token}'}
     response = client.post('/users/me/preferences', json=test_preference, headers=headers)
     assert response.status_code == 201
     assert response.json()['message'] == 'Preferences updated successfully'
 
+@pytest.mark.query_budget(3)
+def test_set_user_preferences_bulk(client: TestClient, token: str):
+    headers = {'Authorization': f'Bearer {token}'}
+    preferences = [
+        {'ingredient_id': 1, 'preference_type': 'dislike'},
+        {'ingredient_id': 2, 'preference_type': 'like'},
+        {'ingredient_id': 3, 'preference_type': 'allergy'},
+    ]
+    response = client.put('/users/me/preferences', json=preferences, headers=headers)
+    assert response.status_code == 200
+    assert response.json()['updated'] == 3
+
+    # Replace keeps only the given ingredients
+    response = client.put('/users/me/preferences?replace=true', json=preferences[1:], headers=headers)
+    assert response.status_code == 200
+    saved = client.get('/users/me/preferences', headers=headers).json()
+    assert sorted((p['ingredient_id'], p['preference_type']) for p in saved) == [(2, 'like'), (3, 'allergy')]
+
+    response = client.put('/users/me/preferences', json=[{'ingredient_id': 999999, 'preference_type': 'like'}], headers=headers)
+    assert response.status_code == 400
+
+@pytest.mark.query_budget(2)
 def test_get_saved_recipes(client: TestClient, token: str):
     headers = {'Authorization': f'Bearer {token}'}
     response = client.get('/users/me/saved-recipes', headers=headers)
     assert response.status_code == 200
-    assert 'items' in response.json()
\ No newline at end of file
+    assert 'items' in response.json()
+
+@pytest.mark.query_budget(3)
+def test_get_saved_recipes_paginated(client: TestClient, token: str, recipe_ids: List[int]):
+    headers = {'Authorization': f'Bearer {token}'}
+    for recipe_id in recipe_ids:
+        client.post('/users/me/saved-recipes', json={'recipe_id': recipe_id}, headers=headers)
+
+    response = client.get('/users/me/saved-recipes', params={'size': 2}, headers=headers)
+    assert response.status_code == 200
+    assert len(response.json()['items']) == 2
+    assert response.json()['total'] >= 3
+    assert 'ingredients' in response.json()['items'][0]
+
+@pytest.mark.query_budget(2)
+def test_saved_recipes_bulk(client: TestClient, token: str, recipe_ids: List[int]):
+    headers = {'Authorization': f'Bearer {token}'}
+    client.delete('/users/me/saved-recipes', params={'recipe_ids': recipe_ids}, headers=headers)
+
+    response = client.post('/users/me/saved-recipes/bulk', json={'recipe_ids': recipe_ids}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()['saved'] == len(recipe_ids)
+    response = client.post('/users/me/saved-recipes', json={'recipe_id': recipe_ids[0]}, headers=headers)
+    assert response.status_code == 400
+
+    response = client.delete('/users/me/saved-recipes', params={'recipe_ids': recipe_ids}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()['removed'] == len(recipe_ids)
+    response = client.delete(f'/users/me/saved-recipes/{recipe_ids[0]}', headers=headers)
+    assert response.status_code == 400
+
+@pytest.mark.query_budget(2)
+def test_users_query_plans(client: TestClient, token: str, capture_queries, full_table_scans):
+    headers = {'Authorization': f'Bearer {token}'}
+    with capture_queries() as queries:
+        assert client.post('/users/me/preferences', json=test_preference, headers=headers).status_code == 201
+        assert client.get('/users/me/saved-recipes', headers=headers).status_code == 200
+        assert client.delete('/users/me/saved-recipes', params={'recipe_ids': [1, 2]}, headers=headers).status_code == 200
+    assert queries
+    assert full_table_scans(queries) == []